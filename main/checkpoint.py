@@ -0,0 +1,96 @@
+import os
+import ast
+import threading
+
+from main.constants import *
+
+class EvaluationCheckpoint:
+	"""
+	append-only record of finished evaluation work, one line per (model, user, train_number)
+		model, int_user_id, train_number, precision @ k, recall @ k, average precision @ k
+
+	each record is flushed and fsynced before it counts as done
+	a torn last line, e.g. from a killed process, is dropped when loaded
+
+	state:
+		self.filename : file of checkpoint
+		self.col_separator : separator of fields
+		self.results : (model, user, train_number) maps to (pk, rk, apk)
+	"""
+	def __init__(self, filename, col_separator=COL_SEPARATOR):
+		"""
+		filename: file of checkpoint, created if not exists
+		col_separator: separator of fields
+		"""
+		self.filename = filename
+		self.col_separator = col_separator
+		self.results = dict()
+		self.lock = threading.Lock()
+
+		if os.path.exists(filename):
+			self._load()
+
+	def get(self, model, user, train_number):
+		"""
+		return (pk, rk, apk) of finished work, None if not done
+		"""
+		return self.results.get((model, int(user), int(train_number)))
+
+	def record(self, model, user, train_number, pk, rk, apk):
+		"""
+		model: model name
+		user: int_user_id
+		train_number: list of train numbers
+		pk, rk, apk: lists of precision @ k, recall @ k, average precision @ k of each train number
+
+		append results of user, durable when returned
+		"""
+		lines = list()
+		for i in range(len(train_number)):
+			lines.append(self.col_separator.join([
+				model,
+				str(int(user)),
+				str(int(train_number[i])),
+				repr(pk[i]),
+				repr(rk[i]),
+				repr(apk[i])
+				]) + "\n")
+
+		with self.lock:
+			with open(self.filename, "a") as file:
+				file.writelines(lines)
+				file.flush()
+				os.fsync(file.fileno())
+
+			for i in range(len(train_number)):
+				self.results[(model, int(user), int(train_number[i]))] = (pk[i], rk[i], apk[i])
+
+	def _load(self):
+		"""
+		load finished work, cut torn last line so later records start on a new line
+		"""
+		with open(self.filename, "rb") as file:
+			content = file.read()
+
+		valid_bytes = 0
+		for line in content.splitlines(keepends=True):
+			# only last line can be torn, it has no newline or is cut inside a field
+			fields = line.decode().rstrip("\n").split(self.col_separator)
+			if not line.endswith(b"\n") or len(fields) != 6:
+				break
+
+			try:
+				model = fields[0]
+				user, train_number = int(fields[1]), int(fields[2])
+				pk, rk, apk = (ast.literal_eval(field) for field in fields[3:])
+			except (ValueError, SyntaxError):
+				break
+
+			self.results[(model, user, train_number)] = (pk, rk, apk)
+			valid_bytes += len(line)
+
+		if valid_bytes < len(content):
+			with open(self.filename, "r+b") as file:
+				file.truncate(valid_bytes)
+				file.flush()
+				os.fsync(file.fileno())
@@ -28,5 +28,25 @@ DEFAULT_VAL_IF_NOT_EXIST = "!other"
 FEATURE_ID = "feature_id"
 FEATURE_DICT = "feature_dict"
 
+# columnar store: directory of one .npy array per column and a json header
+COLUMNAR_EXT = ".columnar/"
+COLUMNAR_HEADER = "header.json"
+COLUMNAR_VERSION = 1
+
+# saved model: directory of one .npy array per learned state and a json header
+MODEL_HEADER = "header.json"
+MODEL_VERSION = 1
+
+REVIEW_COLUMNS = [COL_USER, COL_ITEM, COL_RATING, COL_TIMESTAMP]
+REVIEW_DTYPES = {
+	COL_USER : "int32",
+	COL_ITEM : "int32",
+	COL_RATING : "float32",
+	COL_TIMESTAMP : "int64"
+}
+
 TOP_K = 10
-THRESHOLD_SCALE_5 = 3
\ No newline at end of file
+THRESHOLD_SCALE_5 = 3
+
+# rows per chunk when streaming text files
+DEFAULT_CHUNK_SIZE = 1000000
\ No newline at end of file
@@ -1,6 +1,10 @@
+import csv
 import json
 import ast
+import numpy as np
+import pandas as pd
 from main.constants import *
+from main.feature_codec import FeatureCodec
 
 def load_features(
 	input_file,
@@ -20,8 +24,7 @@ def load_features(
 		features = dict()
 		try:
 			with open(input_file, "r") as file:
-				lines = file.readlines()
-				for line in lines:
+				for line in file:
 					[feature_name, feature_value] = line.strip('\n').split(key_val_separator)
 					if feature_name not in features:
 						features[feature_name] = list()
@@ -34,9 +37,8 @@ def load_features(
 		features = list()
 		try:
 			with open(input_file, "r") as file:
-				lines = file.readlines()
-				for line in lines:
-					features.append(line)
+				for line in file:
+					features.append(line.strip('\n'))
 
 		except IOError:
 			print("{} doesn't exists".format(input_file))
@@ -55,9 +57,8 @@ def load_feature_vec_to_int(input_file):
 	feature_vector_to_int = dict()
 	try:
 		with open(input_file, "r") as file:
-			lines = file.readlines()
-			for line in lines:
-				line = json.load(line.strip('\n'))
+			for line in file:
+				line = json.loads(line.strip('\n'))
 				feature_dict = line[FEATURE_DICT]
 				feature_id = line[FEATURE_ID]
 				feature_vector_to_int[frozenset(feature_dict.items())] = feature_id
@@ -67,11 +68,105 @@ def load_feature_vec_to_int(input_file):
 
 	return feature_vector_to_int
 
+def load_packed_feature_vec_to_int(input_dir):
+	"""
+	input_dir: columnar directory saved by preprocessor.save_feature_vec_to_int with packed=True
+
+	output:
+		feature_vector_to_int: mapping from packed feature vector in bytes to feature_id
+		codec: FeatureCodec to encode / decode packed feature vectors
+	"""
+	header, columns = load_columnar(input_dir, mmap=False)
+	codec = FeatureCodec.from_header(header["codec"])
+
+	packed = columns["packed"]
+	feature_vector_to_int = dict(zip(
+		[row.tobytes() for row in packed],
+		columns[FEATURE_ID].tolist()
+		))
+
+	return feature_vector_to_int, codec
+
+def iter_columns(
+	input_file,
+	columns,
+	dtypes,
+	chunk_size=DEFAULT_CHUNK_SIZE,
+	col_separator=COL_SEPARATOR
+	):
+	"""
+	input_file: input_file_path
+		each line is col_separator separated values, one value per column
+	columns: list of column names
+	dtypes: mapping from column name to numpy dtype
+		None to infer numeric type, str to keep text as is
+	chunk_size: max number of lines in each chunk
+	col_separator: separator between columns
+
+	yield:
+		mapping from column name to numpy array of at most chunk_size lines
+	"""
+	try:
+		reader = pd.read_csv(
+			input_file,
+			sep=col_separator,
+			header=None,
+			names=columns,
+			dtype={col : dtypes[col] for col in columns if dtypes[col] is not None},
+			chunksize=chunk_size,
+			engine="c",
+			quoting=csv.QUOTE_NONE,
+			na_filter=False,
+			float_precision="round_trip"
+			)
+
+	except IOError:
+		print("{} doesn't exists".format(input_file))
+		return
+
+	except pd.errors.EmptyDataError:
+		return
+
+	with reader:
+		for chunk in reader:
+			yield {col : chunk[col].to_numpy() for col in columns}
+
+def iter_mapping(
+	input_file,
+	eval_set={0,1},
+	chunk_size=DEFAULT_CHUNK_SIZE,
+	col_separator=COL_SEPARATOR
+	):
+	"""
+	input_file: input_file_path
+		each line is (key, value) pair separated by col_separator
+	eval_set: for each line of (key, value), indices to calculate
+	chunk_size: max number of lines in each chunk
+	col_separator: separator between key and values
+
+	yield:
+		(keys, values) numpy arrays of at most chunk_size lines
+	"""
+	columns = ["key", "val"]
+	dtypes = dict()
+	for i in range(len(columns)):
+		dtypes[columns[i]] = None if i in eval_set else str
+
+	for chunk in iter_columns(
+		input_file,
+		columns=columns,
+		dtypes=dtypes,
+		chunk_size=chunk_size,
+		col_separator=col_separator
+		):
+		yield chunk["key"], chunk["val"]
+
 def load_mapping(
 	input_file,
 	value_is_set,
 	eval_set={0,1},
-	col_separator=COL_SEPARATOR
+	col_separator=COL_SEPARATOR,
+	chunk_size=DEFAULT_CHUNK_SIZE
 	):
 	"""
 	input_file: input_file_path
@@ -79,71 +174,225 @@ def load_mapping(
 	value_is_set: whether or not value is set
 	eval_set: for each line of (key, value), indices to calculate
 	col_separator: separator between key and values
+	chunk_size: number of lines to parse at once
 
 	output:
 		mapping from key to value in dictionary
 	"""
 	mapping = dict()
-	try:
-		with open(input_file, "r") as file:
-			lines = file.readlines()
-			for line in lines:
-				[key, val] = line.strip('\n').split(col_separator)
+	for (keys, vals) in iter_mapping(
+		input_file,
+		eval_set=eval_set,
+		chunk_size=chunk_size,
+		col_separator=col_separator
+		):
+		if value_is_set:
+			for (key, val) in zip(keys.tolist(), vals.tolist()):
+				if key not in mapping:
+					mapping[key] = list()
+				mapping[key].append(val)
 
-				if 0 in eval_set:
-					key = ast.literal_eval(key)
-				
-				if 1 in eval_set:
-					val = ast.literal_eval(val)
+		else:
+			mapping.update(zip(keys.tolist(), vals.tolist()))
 
-				if value_is_set:
-					if key not in mapping:
-						mapping[key] = list()
-					mapping[key].append(val)
+	return mapping
 
-				else:
-					mapping[key] = val
+def invert_mapping(mapping):
+	"""
+	mapping: one-on-one mapping in dictionary, e.g. restaurants_id_to_int
+
+	output:
+		mapping from value to list of keys
+		keys of each value keep their order in mapping
+	"""
+	inverted = dict()
+	for (key, val) in mapping.items():
+		if val not in inverted:
+			inverted[val] = list()
+		inverted[val].append(key)
+
+	return inverted
+
+def iter_reviews(
+	input_file,
+	eval_set={0,1,2,3},
+	dtypes=REVIEW_DTYPES,
+	chunk_size=DEFAULT_CHUNK_SIZE,
+	col_separator=COL_SEPARATOR
+	):
+	"""
+	input_file: input_file_path
+		each line is col_separator separated review [int_user_id, restaurant, rating, timestamp]
+	eval_set: for each review, indices to calculate, others are kept as str
+	dtypes: mapping from column name to numpy dtype of calculated columns
+	chunk_size: max number of reviews in each chunk
+	col_separator: separator between columns
+
+	yield:
+		mapping from column name to numpy array of at most chunk_size reviews
+	"""
+	column_dtypes = dict()
+	for i in range(len(REVIEW_COLUMNS)):
+		col = REVIEW_COLUMNS[i]
+		column_dtypes[col] = dtypes[col] if i in eval_set else str
+
+	yield from iter_columns(
+		input_file,
+		columns=REVIEW_COLUMNS,
+		dtypes=column_dtypes,
+		chunk_size=chunk_size,
+		col_separator=col_separator
+		)
+
+def load_review_columns(
+	input_file,
+	eval_set={0,1,2,3},
+	dtypes=REVIEW_DTYPES,
+	chunk_size=DEFAULT_CHUNK_SIZE,
+	col_separator=COL_SEPARATOR
+	):
+	"""
+	input_file: input_file_path
+		each line is col_separator separated review [int_user_id, restaurant, rating, timestamp]
+	eval_set: for each review, indices to calculate, others are kept as str
+	dtypes: mapping from column name to numpy dtype of calculated columns
+	chunk_size: number of reviews to parse at once
+	col_separator: separator between columns
+
+	output:
+		mapping from column name to typed numpy array of all reviews
+	"""
+	chunks = list(iter_reviews(
+		input_file,
+		eval_set=eval_set,
+		dtypes=dtypes,
+		chunk_size=chunk_size,
+		col_separator=col_separator
+		))
+
+	columns = dict()
+	for i in range(len(REVIEW_COLUMNS)):
+		col = REVIEW_COLUMNS[i]
+		if len(chunks) > 0:
+			columns[col] = np.concatenate([chunk[col] for chunk in chunks])
+		else:
+			columns[col] = np.empty(0, dtype=dtypes[col] if i in eval_set else object)
+
+	return columns
+
+def load_columnar(
+	input_dir,
+	mmap=True
+	):
+	"""
+	input_dir: directory of columnar store
+		header.json and one .npy array per column
+	mmap: whether or not to memory-map the arrays instead of reading them
+
+	output:
+		header: mapping loaded from header.json
+		columns: mapping from column name to numpy array
+	"""
+	with open(input_dir + COLUMNAR_HEADER, "r") as file:
+		header = json.load(file)
+
+	if header["version"] != COLUMNAR_VERSION:
+		raise ValueError("{} has version {}, expect {}".format(
+			input_dir,
+			header["version"],
+			COLUMNAR_VERSION
+			))
+
+	columns = dict()
+	for [name, dtype] in header["columns"]:
+		array = np.load(input_dir + name + ".npy", mmap_mode="r" if mmap else None)
+		if array.dtype != np.dtype(dtype) or len(array) != header["rows"]:
+			raise ValueError("{}{}.npy doesn't match header".format(input_dir, name))
+		columns[name] = array
+
+	return header, columns
+
+def load_reviews_columnar(
+	input_dir,
+	mmap=True
+	):
+	"""
+	input_dir: directory of columnar reviews written by preprocessor.save_reviews
+	mmap: whether or not to memory-map the arrays instead of reading them
+
+	output:
+		reviews: pandas dataframe of reviews [int_user_id, feature_id, rating, timestamp]
+			backed by the (memory-mapped) arrays without copy
+	"""
+	try:
+		header, columns = load_columnar(input_dir, mmap=mmap)
 
 	except IOError:
-		print("{} doesn't exists".format(input_file))
+		print("{} doesn't exists".format(input_dir))
+		columns = {col : np.empty(0, dtype=REVIEW_DTYPES[col]) for col in REVIEW_COLUMNS}
 
-	return mapping
+	return pd.DataFrame({col : columns[col] for col in REVIEW_COLUMNS}, copy=False)
+
+def reviews_to_dataframe(reviews):
+	"""
+	reviews: list of reviews [int_user_id, feature_id, rating, timestamp]
+		or pandas dataframe of reviews
+		or mapping from column name to numpy array
+
+	output:
+		pandas dataframe of reviews with REVIEW_DTYPES
+		columns already in REVIEW_DTYPES are not copied
+	"""
+	if isinstance(reviews, list):
+		columns = dict()
+		for i in range(len(REVIEW_COLUMNS)):
+			columns[REVIEW_COLUMNS[i]] = np.fromiter(
+				(review[i] for review in reviews),
+				dtype=REVIEW_DTYPES[REVIEW_COLUMNS[i]],
+				count=len(reviews)
+				)
+	else:
+		columns = dict()
+		for col in REVIEW_COLUMNS:
+			columns[col] = np.asarray(reviews[col]).astype(REVIEW_DTYPES[col], copy=False)
+
+	return pd.DataFrame(columns, copy=False)
 
 def load_reviews(
 	input_file,
 	eval_set={0,1,2,3},
-	col_separator=COL_SEPARATOR
+	col_separator=COL_SEPARATOR,
+	columnar=False,
+	chunk_size=DEFAULT_CHUNK_SIZE
 	):
 	"""
 	input_file: input_file_path
 		each line is col_separateor separated review [int_user_id, restaurant, rating, timestamp]
+		if columnar, directory of columnar reviews
 	eval_set: for each review, indices to calculate
 	col_separator: separator between key and values
+	columnar: whether or not input_file is columnar reviews to memory-map
+	chunk_size: number of reviews to parse at once
 
 	output:
 		reviews: list of reviews [int_user_id, restaurant, rating, timestamp]
+			if columnar, pandas dataframe of reviews backed by memory-mapped arrays
 	"""
-	reviews = list()
-	try:
-		with open(input_file, "r") as file:
-			lines = file.readlines()
-			for line in lines:
-				[user, restaurant, rating, timestamp] = line.strip('\n').split(col_separator)
-				if 0 in eval_set:
-					user = ast.literal_eval(user)
-
-				if 1 in eval_set:
-					restaurant = ast.literal_eval(restaurant)
-				
-				if 2 in eval_set:
-					rating = ast.literal_eval(rating)
-
-				if 3 in eval_set:
-					timestamp = ast.literal_eval(timestamp)
+	if columnar:
+		return load_reviews_columnar(input_file)
 
-				reviews.append([user, restaurant, rating, timestamp])
+	# keep ratings in float64, so values are same as written in text
+	dtypes = dict(REVIEW_DTYPES)
+	dtypes[COL_RATING] = "float64"
 
-	except IOError:
-		print("{} doesn't exists".format(input_file))
+	reviews = list()
+	for chunk in iter_reviews(
+		input_file,
+		eval_set=eval_set,
+		dtypes=dtypes,
+		chunk_size=chunk_size,
+		col_separator=col_separator
+		):
+		reviews.extend(map(list, zip(*(chunk[col].tolist() for col in REVIEW_COLUMNS))))
 
 	return reviews
\ No newline at end of file
@@ -6,13 +6,21 @@ from datetime import datetime
 from main.constants import *
 from main.data_loader import *
 from main.recommendar import *
+from main.checkpoint import EvaluationCheckpoint
 
-def one_for_all_load():
+def one_for_all_load(columnar=False):
 	"""
 	helper function
 	load reviews, user_city, rest_city
+
+	columnar: whether or not to memory-map columnar reviews instead of parsing text
+
+	reviews are loaded as typed pandas dataframe
 	"""
-	reviews = load_reviews(DATA_DIR + "dedup_filtered_reviews.data")
+	if columnar:
+		reviews = load_reviews(DATA_DIR + "dedup_filtered_reviews" + COLUMNAR_EXT, columnar=True)
+	else:
+		reviews = reviews_to_dataframe(load_review_columns(DATA_DIR + "dedup_filtered_reviews.data"))
 	
 	user_city = load_mapping(
 		input_file=DATA_DIR + "int_user_id_to_cities.data", 
@@ -47,7 +55,11 @@ def evaluate_models_for_rounds(
 	latest_rating_limiter=3,
 	training_number_params=[0.3, 0.5, 0.7],
 	is_params_ratio=True,
-	col_separator=COL_SEPARATOR
+	col_separator=COL_SEPARATOR,
+	load_columnar=False,
+	num_workers=1,
+	warm_start=False,
+	report_dir=None
 	):
 	"""
 	Do rounds of evaluate_models_on_yelp_open_dataset
@@ -110,11 +122,30 @@ def evaluate_models_for_rounds(
 
 		col_separator:
 			separator for output file	
+
+		load_columnar:
+			whether or not to load memory-mapped columnar reviews
+
+		num_workers:
+			num of processes to evaluate users on, see LocalRecommendar.train_for_all_user
+
+		warm_start:
+			whether or not models of larger train numbers start from smaller ones, see LocalRecommendar.personalized_train
+
+		report_dir:
+			directory of an earlier run with same parameters and seeds to resume
+			None, rounds are written to a new directory
+
+	output directory:
+		round i is written to round_i/ of the run directory, so a run can be resumed by report_dir
 	"""
-	filedir = "{}{}".format(
-			output_dir, 
-			datetime.today().strftime('%Y-%m-%d-%H:%M:%S/')
-			)
+	if report_dir is None:
+		filedir = "{}{}".format(
+				output_dir, 
+				datetime.today().strftime('%Y-%m-%d-%H:%M:%S/')
+				)
+	else:
+		filedir = report_dir
 	os.makedirs(os.path.dirname(filedir), exist_ok=True)
 
 	if seed is None:
@@ -138,7 +169,11 @@ def evaluate_models_for_rounds(
 			latest_rating_limiter=latest_rating_limiter,
 			training_number_params=training_number_params,
 			is_params_ratio=is_params_ratio,
-			col_separator=col_separator
+			col_separator=col_separator,
+			load_columnar=load_columnar,
+			num_workers=num_workers,
+			warm_start=warm_start,
+			report_dir=f"{filedir}round_{i}/"
 			)
 
 def evaluate_models_on_yelp_open_dataset(
@@ -155,7 +190,11 @@ def evaluate_models_on_yelp_open_dataset(
 	latest_rating_limiter=3,
 	training_number_params=[1,3,5,7,10],
 	is_params_ratio=False,
-	col_separator=COL_SEPARATOR
+	col_separator=COL_SEPARATOR,
+	load_columnar=False,
+	num_workers=1,
+	warm_start=False,
+	report_dir=None
 	):
 	"""
 	evaluate models on yelp open dataset by sample
@@ -216,10 +255,25 @@ def evaluate_models_on_yelp_open_dataset(
 		col_separator:
 			separator for output file
 
+		load_columnar:
+			whether or not to load memory-mapped columnar reviews
+
+		num_workers:
+			num of processes to evaluate users on, see LocalRecommendar.train_for_all_user
+
+		warm_start:
+			whether or not models of larger train numbers start from smaller ones, see LocalRecommendar.personalized_train
+
+		report_dir:
+			directory of an earlier run with same parameters and seed to resume
+			users finished in its checkpoint.data are not trained again
+			None, a new directory is created in output_dir
+
 	output file:
 		report.data
+		checkpoint.data, see EvaluationCheckpoint
 	"""
-	reviews, user_city, rest_city, rest_id_to_int = one_for_all_load()
+	reviews, user_city, rest_city, rest_id_to_int = one_for_all_load(columnar=load_columnar)
 	user_ratings = map_user_to_ratings(reviews)
 
 	user_list_all = list()
@@ -241,31 +295,65 @@ def evaluate_models_on_yelp_open_dataset(
 	else:
 		user_list = user_list_all
 
-	filedir = "{}{}".format(
-			output_dir, 
-			datetime.today().strftime('%Y-%m-%d-%H:%M:%S/')
-			)
+	if report_dir is None:
+		filedir = "{}{}".format(
+				output_dir, 
+				datetime.today().strftime('%Y-%m-%d-%H:%M:%S/')
+				)
+	else:
+		filedir = report_dir
 	os.makedirs(os.path.dirname(filedir), exist_ok=True)
 
 	filename = filedir + "report.data"
+	report_lines = list()
+	if os.path.exists(filename):
+		with open(filename, "r") as file:
+			report_lines = file.read().splitlines()
+
+	header_lines = [
+		f"models = {models}",
+		f"evaluate_on_sample_users = {evaluate_on_sample_users}",
+		f"sample_list = {sample_list}",
+		f"sample_limit = {sample_limit}",
+		f"seed = {seed}",
+		f"actual seed = {np.random.get_state()[2]}",
+		f"min_rating = {min_rating}",
+		f"k = {k}",
+		f"removeSeen = {removeSeen}",
+		f"infer_loc_by_latest_rating_only = {infer_loc_by_latest_rating_only}",
+		f"latest_rating_limiter = {latest_rating_limiter}",
+		f"training_number_params = {training_number_params}",
+		f"is_params_ratio = {is_params_ratio}",
+		f"warm_start = {warm_start}",
+		f"col_separator = {col_separator}",
+		f"user_list = {user_list}"
+	]
+
+	# resumed run must have same header, models may differ as results are kept per model
+	if len(report_lines) > 0:
+		differ = [
+			line.split(" = ")[0] for (line, stored) in zip(header_lines, report_lines + [""] * len(header_lines))
+			if line != stored and not line.startswith("models = ")
+		]
+		if len(differ) > 0:
+			raise ValueError(f"report_dir {filedir} has different {differ}: not same parameters nor seed")
+
+	# models with MAP in report are done
+	reported_models = set(line.split(col_separator)[0] for line in report_lines[len(header_lines):])
+
+	checkpoint = EvaluationCheckpoint(filedir + "checkpoint.data", col_separator=col_separator)
+
 	with open(filename, "a") as file:
-		file.write(f"models = {models}\n")
-		file.write(f"evaluate_on_sample_users = {evaluate_on_sample_users}\n")
-		file.write(f"sample_list = {sample_list}\n")
-		file.write(f"sample_limit = {sample_limit}\n")
-		file.write(f"seed = {seed}\n")
-		file.write(f"actual seed = {np.random.get_state()[2]}\n")
-		file.write(f"min_rating = {min_rating}\n")
-		file.write(f"k = {k}\n")
-		file.write(f"removeSeen = {removeSeen}\n")
-		file.write(f"infer_loc_by_latest_rating_only = {infer_loc_by_latest_rating_only}\n")
-		file.write(f"latest_rating_limiter = {latest_rating_limiter}\n")
-		file.write(f"training_number_params = {training_number_params}\n")
-		file.write(f"is_params_ratio = {is_params_ratio}\n")
-		file.write(f"col_separator = {col_separator}\n")
-		file.write(f"user_list = {user_list}\n")
+		if len(report_lines) > 0:
+			file.write(f"resumed = {datetime.today().strftime('%Y-%m-%d-%H:%M:%S')}\n")
+		else:
+			file.writelines(line + "\n" for line in header_lines)
 
 	for model in models:
+		if model in reported_models:
+			print(f"{model} is already reported in {filename}")
+			continue
+
 		recommendar = get_recommendar(
 			reviews=reviews,
 			user_city=user_city,
@@ -278,13 +366,20 @@ def evaluate_models_on_yelp_open_dataset(
 			latest_rating_limiter=latest_rating_limiter
 			)
 
-		apk_all = recommendar.train_for_all_user(
-			output_dir=filedir,
-			user_list=user_list,
-			train_number_params=training_number_params,
-			is_params_ratio=is_params_ratio,
-			col_separator=col_separator
-			)
-
-		with open(filename, "a") as file:
-			file.write(f"{model}{col_separator}{apk_all}\n")
\ No newline at end of file
+		# shared models and shared memory of each model are released before next one
+		try:
+			apk_all = recommendar.train_for_all_user(
+				output_dir=filedir,
+				user_list=user_list,
+				train_number_params=training_number_params,
+				is_params_ratio=is_params_ratio,
+				col_separator=col_separator,
+				num_workers=num_workers,
+				warm_start=warm_start,
+				checkpoint=checkpoint
+				)
+
+			with open(filename, "a") as file:
+				file.write(f"{model}{col_separator}{apk_all}\n")
+		finally:
+			recommendar.close()
\ No newline at end of file
@@ -1,3 +1,4 @@
+import numpy as np
 import pandas as pd
 
 from main.constants import *
@@ -18,39 +19,157 @@ def evaluate_top_k_for_user(
 		df_truth: pandas dataframe of groudtruth
 		df_pred: pandas dataframe of prediction result
 		k: precision at k
-		threshold: consider item relevant if score > threshold
+		threshold: consider item relevant if score >= threshold
 		userCol: column name of users
 		itemCol: column name of items
 		rateCol: column name of ratings score
 		predCol: column name of prediction score
 
+	index label of df_pred is rank of prediction, evaluation stops at label k
+	see evaluate_top_k_batch to evaluate many users at once
+
 	return precision at k, recall at k, average precision as k
 	"""
+	total_relevant = int((df_truth[rateCol].to_numpy() >= threshold).sum())
 
-	df_truth_thres = df_truth.loc[df_truth[COL_RATING] >= threshold]
-	total_relevant = df_truth_thres.shape[0]
+	# stop at first prediction with index label k
+	ranks = df_pred.index.to_numpy().astype(np.int64)
+	cut = np.flatnonzero(ranks == k)
+	cut = cut[0] if len(cut) > 0 else len(ranks)
 
-	hit_count = 0
-	sum_precision = 0
-	for index, row in df_pred.iterrows():
-		if (index == k):
-			break
+	users = np.concatenate([df_pred[userCol].to_numpy()[:1], df_truth[userCol].to_numpy()[:1]])
+	users = users[:1].astype(np.int64) if len(users) > 0 else np.zeros(1, dtype=np.int64)
 
-		if ((df_truth_thres[COL_USER] == row[COL_USER]) 
-			& (df_truth_thres[COL_ITEM] == row[COL_ITEM])).any():
-			hit_count += 1
-			sum_precision += hit_count / (index + 1)
+	_, pk, rk, apk = evaluate_top_k_batch(
+		truth_users=df_truth[userCol].to_numpy(),
+		truth_items=df_truth[itemCol].to_numpy(),
+		truth_ratings=df_truth[rateCol].to_numpy(),
+		pred_users=df_pred[userCol].to_numpy()[:cut],
+		pred_items=df_pred[itemCol].to_numpy()[:cut],
+		pred_ranks=ranks[:cut],
+		users=users,
+		k=k,
+		threshold=threshold
+		)
 
-	pk = hit_count / k
+	# same types as when evaluated row by row
+	pk = float(pk[0])
+	rk = float(rk[0]) if total_relevant > 0 else 0
+	apk = float(apk[0]) if apk[0] > 0 else 0
+
+	return pk, rk, apk
+
+def evaluate_top_k_batch(
+	truth_users,
+	truth_items,
+	truth_ratings,
+	pred_users,
+	pred_items,
+	pred_ranks=None,
+	users=None,
+	k=TOP_K,
+	threshold=THRESHOLD_SCALE_5
+	):
+	"""
+	Evaluate precision at k, recall at k, average precision at k of many users at once
+
+		truth_users: numpy array of int_user_id of groundtruth
+		truth_items: numpy array of feature_id of groundtruth
+		truth_ratings: numpy array of rating of groundtruth
+		pred_users: numpy array of int_user_id of predictions
+		pred_items: numpy array of feature_id of predictions
+			predictions of each user are in rank order, users may interleave
+		pred_ranks: numpy array of 0-based rank of predictions
+			default to position among predictions of same user
+			predictions of a user from first one with rank k are not evaluated
+		users: numpy array of int_user_id to evaluate
+			default to sorted users in groundtruth or predictions
+		k: precision at k
+		threshold: consider item relevant if rating >= threshold
+
+	same result as evaluate_top_k_for_user on each user's groundtruth and predictions
+
+	return:
+		users
+		numpy array of precision at k of each user
+		numpy array of recall at k of each user
+		numpy array of average precision at k of each user
+	"""
+	truth_users = np.asarray(truth_users, dtype=np.int64)
+	truth_items = np.asarray(truth_items, dtype=np.int64)
+	pred_users = np.asarray(pred_users, dtype=np.int64)
+	pred_items = np.asarray(pred_items, dtype=np.int64)
 
-	if total_relevant == 0:
-		rk = 0
-	else:
-		rk = hit_count / total_relevant
+	if users is None:
+		users = np.union1d(truth_users, pred_users)
+	users = np.asarray(users, dtype=np.int64)
 
-	if hit_count == 0:
-		apk = 0
-	else:
-		apk = sum_precision / hit_count
+	# num of relevant groundtruth of each user, duplicates are counted
+	relevant = np.asarray(truth_ratings) >= threshold
+	relevant_users, relevant_counts = np.unique(truth_users[relevant], return_counts=True)
+	total_relevant = np.zeros(len(users), dtype=np.int64)
+	index = np.searchsorted(relevant_users, users)
+	found = index < len(relevant_users)
+	found[found] = relevant_users[index[found]] == users[found]
+	total_relevant[found] = relevant_counts[index[found]]
+
+	hit_count = np.zeros(len(users), dtype=np.int64)
+	sum_precision = np.zeros(len(users), dtype=np.float64)
+
+	if len(pred_users) > 0:
+		# group predictions by user, keep rank order in each user
+		order = np.argsort(pred_users, kind="stable")
+		sorted_users = pred_users[order]
+		is_start = np.ones(len(order), dtype=bool)
+		is_start[1:] = sorted_users[1:] != sorted_users[:-1]
+		starts = np.flatnonzero(is_start)
+		group = np.cumsum(is_start) - 1
+		positions = np.arange(len(order)) - starts[group]
+
+		ranks = positions if pred_ranks is None else np.asarray(pred_ranks, dtype=np.int64)[order]
+
+		# drop predictions from first one with rank k of each user
+		reached_k = np.cumsum(ranks == k)
+		reached_k -= (reached_k - (ranks == k))[starts][group]
+		kept = reached_k == 0
+
+		# (user, item) pairs of relevant groundtruth as int64 keys
+		min_item = min(truth_items.min(initial=0), pred_items.min(initial=0))
+		num_items = max(truth_items.max(initial=0), pred_items.max(initial=0)) - min_item + 1
+		relevant_keys = np.unique(truth_users[relevant] * num_items + truth_items[relevant] - min_item)
+		pred_keys = sorted_users * num_items + pred_items[order] - min_item
+
+		index = np.searchsorted(relevant_keys, pred_keys)
+		is_hit = index < len(relevant_keys)
+		is_hit[is_hit] = relevant_keys[index[is_hit]] == pred_keys[is_hit]
+		is_hit &= kept
+
+		# hit count so far of each user at each prediction
+		hits_so_far = np.cumsum(is_hit)
+		hits_so_far -= (hits_so_far - is_hit)[starts][group]
+		precision = np.where(is_hit, hits_so_far / (ranks + 1), 0.0)
+
+		# sum precision rank by rank, same summation order as row by row
+		group_hits = np.zeros(len(starts), dtype=np.int64)
+		group_precision = np.zeros(len(starts), dtype=np.float64)
+		ends = np.append(starts[1:], len(order))
+		for position in range(int((ends - starts).max())):
+			has_position = starts + position < ends
+			rows = starts[has_position] + position
+			group_hits[has_position] += is_hit[rows]
+			group_precision[has_position] += precision[rows]
+
+		# users to evaluate may be in any order
+		user_order = np.argsort(users, kind="stable")
+		sorted_eval_users = users[user_order]
+		index = np.searchsorted(sorted_eval_users, sorted_users[starts])
+		found = index < len(users)
+		found[found] = sorted_eval_users[index[found]] == sorted_users[starts][found]
+		hit_count[user_order[index[found]]] = group_hits[found]
+		sum_precision[user_order[index[found]]] = group_precision[found]
+
+	pk = hit_count / k
+	rk = np.divide(hit_count, total_relevant, out=np.zeros(len(users)), where=total_relevant > 0)
+	apk = np.divide(sum_precision, hit_count, out=np.zeros(len(users)), where=hit_count > 0)
 
-	return pk, rk, apk
\ No newline at end of file
+	return users, pk, rk, apk
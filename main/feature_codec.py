@@ -0,0 +1,134 @@
+import numpy as np
+from main.constants import *
+
+#-------------------------------
+# Constants
+#-------------------------------
+VAL_CODE_DTYPE = np.uint16
+
+class FeatureCodec:
+	"""
+	compact encoding of a restaurant feature vector
+
+	packed bytes = bitset of true/false & exist features + uint16 code of each value feature
+
+	state:
+		self.tffeature : list of true/false features
+		self.existfeature : list of exist features
+		self.bit_features : list of true/false and exist features, one bit each
+		self.val_features : list of value features, one code each
+		self.val_vocab : value feature maps to list of values, code is index in the list
+		self.val_index : value feature maps to mapping from value to code
+	"""
+	def __init__(
+		self,
+		tffeature,
+		valfeature,
+		existfeature,
+		val_vocab=None
+		):
+		"""
+		tffeature: list of true/false features
+		valfeature: dict of value features to values
+		existfeature: list of exist features
+		val_vocab: value feature maps to list of values, e.g. loaded from header
+			default to sorted values in valfeature
+		"""
+		self.tffeature = list(tffeature)
+		self.existfeature = list(existfeature)
+		self.bit_features = self.tffeature + self.existfeature
+		self.val_features = list(valfeature)
+
+		if val_vocab is None:
+			val_vocab = dict()
+			for feature in self.val_features:
+				values = set(val for val in valfeature[feature] if isinstance(val, str))
+				values.add(DEFAULT_VAL_IF_NOT_EXIST)
+				val_vocab[feature] = sorted(values)
+
+		self.val_vocab = dict()
+		self.val_index = dict()
+		for feature in self.val_features:
+			self.val_vocab[feature] = list(val_vocab[feature])
+			self.val_index[feature] = {val : code for (code, val) in enumerate(self.val_vocab[feature])}
+
+		self.num_bit_bytes = (len(self.bit_features) + 7) // 8
+		self.row_bytes = self.num_bit_bytes + len(self.val_features) * np.dtype(VAL_CODE_DTYPE).itemsize
+
+	def code_of(self, feature, value):
+		"""
+		return code of value for value feature
+		value not seen before is appended to vocabulary
+		"""
+		index = self.val_index[feature]
+		if value not in index:
+			index[value] = len(self.val_vocab[feature])
+			self.val_vocab[feature].append(value)
+		return index[value]
+
+	def encode(self, feature_dict):
+		"""
+		feature_dict: mapping from each feature to value
+
+		return packed bytes of feature_dict
+		"""
+		bits = np.fromiter(
+			(feature_dict[feature] for feature in self.bit_features),
+			dtype=bool,
+			count=len(self.bit_features)
+			)
+		codes = np.fromiter(
+			(self.code_of(feature, feature_dict[feature]) for feature in self.val_features),
+			dtype=VAL_CODE_DTYPE,
+			count=len(self.val_features)
+			)
+		return np.packbits(bits).tobytes() + codes.tobytes()
+
+	def decode(self, packed):
+		"""
+		packed: packed bytes from encode
+
+		return feature vector as frozenset of (feature, value), same as map_restaurant_to_feature_dict
+		"""
+		row = np.frombuffer(packed, dtype=np.uint8)
+		bits = np.unpackbits(row[:self.num_bit_bytes], count=len(self.bit_features)).astype(bool)
+		codes = row[self.num_bit_bytes:].view(VAL_CODE_DTYPE)
+
+		bits = bits.tolist()
+		num_tffeature = len(self.tffeature)
+
+		# same order of features as map_restaurant_to_feature_dict
+		feature_dict = dict()
+		for (feature, bit) in zip(self.tffeature, bits[:num_tffeature]):
+			feature_dict[feature] = bit
+		for (feature, code) in zip(self.val_features, codes.tolist()):
+			feature_dict[feature] = self.val_vocab[feature][code]
+		for (feature, bit) in zip(self.existfeature, bits[num_tffeature:]):
+			feature_dict[feature] = bit
+
+		return frozenset(feature_dict.items())
+
+	def to_header(self):
+		"""
+		return json serializable state of this codec
+		"""
+		return {
+			"tffeature" : self.tffeature,
+			"existfeature" : self.existfeature,
+			"val_features" : self.val_features,
+			"val_vocab" : self.val_vocab
+		}
+
+	@classmethod
+	def from_header(cls, header):
+		"""
+		header: state from to_header
+
+		return codec with same encoding
+		"""
+		return cls(
+			tffeature=header["tffeature"],
+			valfeature={feature : None for feature in header["val_features"]},
+			existfeature=header["existfeature"],
+			val_vocab=header["val_vocab"]
+			)
@@ -0,0 +1,232 @@
+import os
+import copy
+import threading
+
+from main.constants import *
+from main.data_loader import *
+from main.feature_codec import FeatureCodec
+from main.preprocessor import *
+
+class FeatureIndex:
+	"""
+	lookup from restaurant feature vector to feature_id, for restaurants opened after preprocess
+
+	state:
+		self.tffeature : list of true/false features
+		self.valfeature : value features maps to values
+		self.existfeature : list of exist features
+		self.codec : FeatureCodec to pack feature vectors
+		self.feature_vector_to_int : packed feature vector maps to feature_id
+		self.restaurants_id_to_int : business_id maps to feature_id
+		self.feature_id_to_cities : feature_id maps to city
+		self.count_feature_id : max feature_id so far
+		self.new_restaurants : restaurants assigned since last flush
+		self.new_feature_vector_to_int : feature vectors allocated since last flush
+	"""
+	def __init__(
+		self,
+		tffeature,
+		valfeature,
+		existfeature,
+		feature_vector_to_int,
+		restaurants_id_to_int,
+		feature_id_to_cities,
+		codec=None
+		):
+		"""
+		tffeature: list of true/false features
+		valfeature: dict of value features to values
+		existfeature: list of exist features
+		feature_vector_to_int: mapping from feature_dict to feature_id
+			keys are packed bytes if codec is given
+		restaurants_id_to_int: mapping from business_id to feature_id
+		feature_id_to_cities: mapping from feature_id to city
+		codec: FeatureCodec of packed keys in feature_vector_to_int
+		"""
+		self.tffeature = tffeature
+		self.valfeature = valfeature
+		self.existfeature = existfeature
+
+		if codec is None:
+			codec = FeatureCodec(tffeature, valfeature, existfeature)
+			feature_vector_to_int = {
+				codec.encode(dict(feature_dict)) : feature_id
+				for (feature_dict, feature_id) in feature_vector_to_int.items()
+			}
+
+		self.codec = codec
+		self.feature_vector_to_int = feature_vector_to_int
+		self.restaurants_id_to_int = restaurants_id_to_int
+		self.feature_id_to_cities = feature_id_to_cities
+		self.count_feature_id = max(feature_vector_to_int.values(), default=0)
+
+		self.new_restaurants = list()
+		self.new_feature_vector_to_int = dict()
+		self.lock = threading.Lock()
+
+	@classmethod
+	def load(cls, input_dir):
+		"""
+		input_dir: output directory of preprocessor.preprocess_yelp_open_dataset
+
+		return FeatureIndex over feature_vector_to_int.columnar/ if exists
+			otherwise over feature_vector_to_int.json
+		"""
+		tffeature = load_features(input_dir + "tffeature.data")
+		existfeature = load_features(input_dir + "existfeature.data")
+		valfeature = load_features(input_dir + "valfeature.data", load_mapping=True)
+
+		packed_dir = input_dir + "feature_vector_to_int" + COLUMNAR_EXT
+		if os.path.isdir(packed_dir):
+			feature_vector_to_int, codec = load_packed_feature_vec_to_int(packed_dir)
+		else:
+			feature_vector_to_int = load_feature_vec_to_int(input_dir + "feature_vector_to_int.json")
+			codec = None
+
+		restaurants_id_to_int = load_mapping(
+			input_file=input_dir + "restaurants_id_to_int.data",
+			value_is_set=False,
+			eval_set={1}
+			)
+		feature_id_to_cities = load_mapping(
+			input_file=input_dir + "feature_id_to_cities.data",
+			value_is_set=False,
+			eval_set={0}
+			)
+
+		return cls(
+			tffeature=tffeature,
+			valfeature=valfeature,
+			existfeature=existfeature,
+			feature_vector_to_int=feature_vector_to_int,
+			restaurants_id_to_int=restaurants_id_to_int,
+			feature_id_to_cities=feature_id_to_cities,
+			codec=codec
+			)
+
+	def lookup(self, feature_vector):
+		"""
+		feature_vector: packed feature vector
+
+		return feature_id of feature_vector, None if not seen
+		"""
+		return self.feature_vector_to_int.get(feature_vector)
+
+	def assign_feature_id(self, business):
+		"""
+		business: json object of business, as a line of business.json
+
+		return feature_id of business
+			business already known keeps its feature_id
+			new feature vector is allocated next feature_id
+		"""
+		business_id = business[RESTAURANT_ID]
+		if business_id in self.restaurants_id_to_int:
+			return self.restaurants_id_to_int[business_id]
+
+		if not (is_valid_business(business)
+			and is_restaurant(business)
+			and is_open(business)):
+			raise ValueError(f"business {business_id} is not a valid open restaurant")
+
+		# preprocess_* modify the json object in place
+		restaurant = copy.deepcopy(business)
+		preprocess_categories(restaurant)
+		preprocess_hours_extend_workdays(restaurant)
+		preprocess_attributes(restaurant)
+
+		with self.lock:
+			# another thread may have assigned same business meanwhile
+			if business_id in self.restaurants_id_to_int:
+				return self.restaurants_id_to_int[business_id]
+
+			feature_vector = map_restaurant_to_feature_dict(
+				restaurant,
+				self.codec.tffeature,
+				self.codec.val_features,
+				self.codec.existfeature,
+				codec=self.codec
+				)
+
+			feature_id = self.lookup(feature_vector)
+			if feature_id is None:
+				self.count_feature_id += 1
+				feature_id = self.count_feature_id
+				self.feature_vector_to_int[feature_vector] = feature_id
+				self.new_feature_vector_to_int[feature_vector] = feature_id
+				self.feature_id_to_cities[feature_id] = restaurant[CITY]
+
+			self.restaurants_id_to_int[business_id] = feature_id
+			self.new_restaurants.append(restaurant)
+
+		return feature_id
+
+	def flush(self, output_dir):
+		"""
+		output_dir: output directory of preprocessor.preprocess_yelp_open_dataset
+
+		append restaurants and feature vectors assigned since last flush to output files
+		feature_vector_to_int.columnar/ is rewritten if exists
+		"""
+		with self.lock:
+			new_restaurants = self.new_restaurants
+			new_feature_vector_to_int = self.new_feature_vector_to_int
+			self.new_restaurants = list()
+			self.new_feature_vector_to_int = dict()
+
+			new_restaurants_id_to_int = dict()
+			for restaurant in new_restaurants:
+				new_restaurants_id_to_int[restaurant[RESTAURANT_ID]] = \
+					self.restaurants_id_to_int[restaurant[RESTAURANT_ID]]
+
+			new_feature_id_to_cities = dict()
+			for feature_id in new_feature_vector_to_int.values():
+				new_feature_id_to_cities[feature_id] = self.feature_id_to_cities[feature_id]
+
+			save_filtered_open_restaurants(
+				restaurants=new_restaurants,
+				output_dir=output_dir,
+				output_file="filtered_open_retaurants.json",
+				append=True
+				)
+
+			save_feature_vec_to_int(
+				feature_vector_to_int=new_feature_vector_to_int,
+				output_dir=output_dir,
+				output_file="feature_vector_to_int.json",
+				append=True,
+				codec=self.codec
+				)
+
+			if os.path.isdir(output_dir + "feature_vector_to_int" + COLUMNAR_EXT):
+				save_feature_vec_to_int(
+					feature_vector_to_int=self.feature_vector_to_int,
+					output_dir=output_dir,
+					output_file="feature_vector_to_int" + COLUMNAR_EXT,
+					codec=self.codec,
+					packed=True
+					)
+
+			save_mapping(
+				mapping=new_restaurants_id_to_int,
+				value_is_set=False,
+				output_dir=output_dir,
+				output_file="restaurants_id_to_int.data",
+				append=True
+				)
+
+			save_mapping(
+				mapping=invert_mapping(new_restaurants_id_to_int),
+				value_is_set=True,
+				output_dir=output_dir,
+				output_file="feature_id_to_restaurants_id.data",
+				append=True
+				)
+
+			save_mapping(
+				mapping=new_feature_id_to_cities,
+				value_is_set=False,
+				output_dir=output_dir,
+				output_file="feature_id_to_cities.data",
+				append=True
+				)
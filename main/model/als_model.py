@@ -1,27 +1,151 @@
 import os
+import atexit
+import threading
+import numpy as np
 import pandas as pd
 
 from pyspark.sql import SparkSession
 from pyspark.sql.types import StructType, StructField
 from pyspark.sql.types import FloatType, IntegerType, LongType
 from pyspark.ml.recommendation import ALS
-from pyspark.sql.functions import desc
+from pyspark.sql.functions import desc, col, row_number
+from pyspark.sql.window import Window
 
 from main.constants import *
-from main.model.model_utils import init_user_item
+from main.model.model_utils import init_user_item, init_users_items, top_k, top_k_per_user, replace_user_reviews
+from main.model.numpy_als_model import Model as NumpyAlsModel
+from main.model.numpy_als_model import save_factors, fold_in_factor, score_user_item
+
+#-------------------------------
+# Constants
+#-------------------------------
+DEFAULT_SPARK_MASTER = "local[*]"
+DEFAULT_SPARK_MEMORY = "16g"
+DEFAULT_SPARK_SHUFFLE_PARTITIONS = 8
+# default 200 partitions is tuned for clusters, too many tiny tasks for local per-city data
+
+#-------------------------------
+# Spark Session
+#-------------------------------
+# one spark session per process, borrowed by models and kept alive until shutdown_spark
+_spark_lock = threading.Lock()
+_spark_config = {
+	"master" : DEFAULT_SPARK_MASTER,
+	"memory" : DEFAULT_SPARK_MEMORY,
+	"shuffle_partitions" : DEFAULT_SPARK_SHUFFLE_PARTITIONS
+}
+_spark_session = None
+_spark_borrowers = 0
+_spark_atexit_registered = False
 
 def envr_check():
 	os.environ["PYSPARK_PYTHON"]="python3"
 	os.environ["PYSPARK_DRIVER_PYTHON"]="python3"
 	os.environ["SPARK_LOCAL_IP"]="localhost"
 
-def start_or_get_spark(app_name="Sample", url="local[*]", memory="10g"):
-	spark = SparkSession.builder.master(url).appName(app_name).getOrCreate()
+def start_or_get_spark(
+	app_name="Sample",
+	url=DEFAULT_SPARK_MASTER,
+	memory="10g",
+	shuffle_partitions=DEFAULT_SPARK_SHUFFLE_PARTITIONS
+	):
+	"""
+	app_name: name of spark application
+	url: spark master
+	memory: driver memory, only takes effect when spark is not started yet
+	shuffle_partitions: spark.sql.shuffle.partitions
+
+	return spark session and spark context
+	"""
+	spark = SparkSession.builder \
+				.master(url) \
+				.appName(app_name) \
+				.config("spark.driver.memory", memory) \
+				.config("spark.sql.shuffle.partitions", shuffle_partitions) \
+				.getOrCreate()
 	sc = spark.sparkContext
 	checkpoint_dir = PROJECT_PATH + 'checkpoint/'
 	sc.setCheckpointDir(checkpoint_dir)
 	return spark, sc
 
+def configure_spark(master=None, memory=None, shuffle_partitions=None):
+	"""
+	master: spark master, e.g. local[4]
+	memory: driver memory, e.g. 16g
+	shuffle_partitions: spark.sql.shuffle.partitions
+
+	configure spark session shared by models
+	arguments left None are kept, takes effect from next start of session
+	"""
+	with _spark_lock:
+		if master is not None:
+			_spark_config["master"] = master
+		if memory is not None:
+			_spark_config["memory"] = memory
+		if shuffle_partitions is not None:
+			_spark_config["shuffle_partitions"] = shuffle_partitions
+
+def borrow_spark(app_name="ALS Model"):
+	"""
+	return spark session and spark context shared in this process
+	session is started on first borrow, each borrow should be paired with release_spark
+	"""
+	global _spark_session, _spark_borrowers, _spark_atexit_registered
+
+	with _spark_lock:
+		if _spark_session is None:
+			envr_check()
+			_spark_session, _ = start_or_get_spark(
+				app_name=app_name,
+				url=_spark_config["master"],
+				memory=_spark_config["memory"],
+				shuffle_partitions=_spark_config["shuffle_partitions"]
+				)
+
+			if not _spark_atexit_registered:
+				atexit.register(shutdown_spark)
+				_spark_atexit_registered = True
+
+		_spark_borrowers += 1
+		return _spark_session, _spark_session.sparkContext
+
+def release_spark():
+	"""
+	give back spark session from borrow_spark
+	session is kept alive for next borrow, see shutdown_spark
+	"""
+	global _spark_borrowers
+
+	with _spark_lock:
+		_spark_borrowers = max(_spark_borrowers - 1, 0)
+
+def shutdown_spark():
+	"""
+	stop spark session shared in this process, called at exit
+	models still borrowing spark can't be used after shutdown
+	"""
+	global _spark_session, _spark_borrowers
+
+	with _spark_lock:
+		if _spark_session is not None:
+			if _spark_borrowers > 0:
+				print(f"Warning: stopping spark session still borrowed by {_spark_borrowers} model(s), close them first")
+			_spark_session.stop()
+			_spark_session = None
+			_spark_borrowers = 0
+
+def factors_to_numpy(sdf_factors, rank):
+	"""
+	helper function
+	sdf_factors: spark dataframe of (id, features) from ALSModel.userFactors or itemFactors
+
+	return sorted ids and numpy array of factors in same order
+	"""
+	pdf_factors = sdf_factors.toPandas().sort_values("id")
+	ids = pdf_factors["id"].to_numpy(dtype=np.int64)
+	factors = np.array(pdf_factors["features"].tolist(), dtype=np.float32).reshape(-1, rank)
+	return ids, factors
+
 class Model:
 	"""
 	state:
@@ -35,6 +159,7 @@ class Model:
 		"""
 		user_id: 
 			this model is for a specific user
+			None for a model shared by all users in data_reviews
 
 		model_name: 
 			give this model a name
@@ -46,11 +171,9 @@ class Model:
 		self.name = model_name
 		self.data = data_reviews
 		
-		envr_check()
-
 		self.spark = None
 		self.sc = None
-		self.spark, self.sc = start_or_get_spark(app_name="ALS Model", memory="16g")
+		self.spark, self.sc = borrow_spark(app_name="ALS Model")
 		self.schema = StructType(
 							(
 								StructField(COL_USER, IntegerType()),
@@ -63,7 +186,7 @@ class Model:
 		self.data_train = self.spark.createDataFrame(
 			self.data,
 			schema=self.schema
-			)
+			).cache()
 
 		self.maxIter = 10
 		self.rank = 10
@@ -72,13 +195,26 @@ class Model:
 		self.nonnegative = True
 		self.seed = 42
 
+		# users folded in after train are scored in numpy, see fold_in_user
+		self.folded_users = dict()
+		self.numpy_item_factors = None
+
 	def close(self):
 		"""
 		do something when close this model
 		"""
-		if self.spark is not None:
-			self.spark.stop()
-			self.sc.stop()
+		if self.spark is None:
+			return
+
+		# release cached data, spark session is kept for other models
+		self.data_train.unpersist()
+		if hasattr(self, "model"):
+			self.model.userFactors.unpersist()
+			self.model.itemFactors.unpersist()
+
+		self.spark = None
+		self.sc = None
+		release_spark()
 		
 	def train(self):
 		"""
@@ -98,13 +234,38 @@ class Model:
 
 		self.model = self.als.fit(self.data_train)
 
-	def predict(self, k=10, removeSeen=True):
+	def predict(self, k=10, removeSeen=True, user_id=None, seen_items=None):
 		"""
 		predict top 10 restaurants on user
 
 		if k <= 0, return all predictions
+		user_id: user to predict on, default to self.user
+			a shared model can predict on any user in its data
+		seen_items: more items to remove before selection if removeSeen
+
+		top k is selected by spark (orderBy + limit plans a TakeOrdered),
+		only k rows are shipped to driver
 		"""
-		user_item = init_user_item(user_id=self.user, data=self.data, removeSeen=removeSeen)
+		if user_id is None:
+			user_id = self.user
+
+		user_item = init_user_item(
+			user_id=user_id,
+			data=self.data,
+			removeSeen=removeSeen,
+			seen_items=seen_items
+			)
+
+		if user_id in self.folded_users:
+			item_ids, item_factors = self.get_numpy_item_factors()
+			pred = score_user_item(
+				user_item,
+				np.array([user_id]),
+				self.folded_users[user_id][None, :],
+				item_ids,
+				item_factors
+				)
+			return top_k(pred, k)
 
 		schema_user_item = StructType(
 								(
@@ -114,7 +275,7 @@ class Model:
 							)
 		user_item = self.spark.createDataFrame(user_item, schema=schema_user_item)
 		sdf_pred = self.model.transform(user_item)
-		pdf_pred = sdf_pred.where(f"{COL_USER} == {self.user}") \
+		pdf_pred = sdf_pred.where(f"{COL_USER} == {user_id}") \
 					.orderBy(desc(COL_PREDICTION))
 
 		if k <= 0:
@@ -123,8 +284,118 @@ class Model:
 		else:
 			return pdf_pred.limit(k).toPandas()
 
+	def predict_many(self, user_ids, k=10, removeSeen=True, seen_pairs=None):
+		"""
+		predict top k restaurants on each user in user_ids in one pass
+
+		if k <= 0, return all predictions
+		return pandas dataframe of predictions sorted by user then prediction
+		seen_pairs: pandas dataframe of more user_item pairs to remove before selection if removeSeen
+
+		top k of each user is selected by spark window, only k rows per user are shipped to driver
+		"""
+		folded = [user_id for user_id in user_ids if user_id in self.folded_users]
+		if len(folded) > 0:
+			preds = list()
+			for user_id in folded:
+				seen_items = None
+				if seen_pairs is not None:
+					seen_items = seen_pairs.loc[seen_pairs[COL_USER] == user_id, COL_ITEM].to_numpy()
+				preds.append(self.predict(k=k, removeSeen=removeSeen, user_id=user_id, seen_items=seen_items))
+
+			others = [user_id for user_id in user_ids if user_id not in self.folded_users]
+			if len(others) > 0:
+				preds.append(self.predict_many(user_ids=others, k=k, removeSeen=removeSeen, seen_pairs=seen_pairs))
+			return top_k_per_user(pd.concat(preds, ignore_index=True), k).reset_index(drop=True)
+
+		user_item = init_users_items(
+			user_ids=user_ids,
+			data=self.data,
+			removeSeen=removeSeen,
+			seen_pairs=seen_pairs
+			)
+
+		schema_user_item = StructType(
+								(
+									StructField(COL_USER, IntegerType()),
+									StructField(COL_ITEM, IntegerType())
+								)
+							)
+		user_item = self.spark.createDataFrame(user_item, schema=schema_user_item)
+		sdf_pred = self.model.transform(user_item)
+
+		if k > 0:
+			window = Window.partitionBy(COL_USER).orderBy(desc(COL_PREDICTION))
+			sdf_pred = sdf_pred.withColumn("rank", row_number().over(window)) \
+						.where(col("rank") <= k) \
+						.drop("rank")
+
+		return sdf_pred.orderBy(COL_USER, desc(COL_PREDICTION)).toPandas()
+
+	def get_numpy_item_factors(self):
+		"""
+		return sorted item ids and item factors of trained model in numpy, collected once
+		"""
+		if self.numpy_item_factors is None:
+			self.numpy_item_factors = factors_to_numpy(self.model.itemFactors, self.rank)
+		return self.numpy_item_factors
+
+	def fold_in_user(self, user_id, user_reviews):
+		"""
+		update factor of one user from current ratings without a spark job, item factors are kept
+
+		user_id: user to update, added to model if not trained on
+		user_reviews: pandas dataframe of all current reviews of user_id
+
+		return factor of user_id
+		"""
+		item_ids, item_factors = self.get_numpy_item_factors()
+		factor = fold_in_factor(
+			item_ids,
+			item_factors,
+			user_reviews,
+			self.regParam,
+			self.nonnegative
+			)
+
+		self.folded_users[user_id] = factor
+		self.data = replace_user_reviews(self.data, user_id, user_reviews)
+		return factor
+
 	def save_model(self, output_dir):
 		"""
 		save this model under output_dir with self.<model_name>_<current_time>
+		return directory of saved model, see load_model
+		"""
+		user_ids, user_factors = factors_to_numpy(self.model.userFactors, self.rank)
+		item_ids, item_factors = self.get_numpy_item_factors()
+
+		# folded in users replace their trained factors
+		for (user_id, factor) in self.folded_users.items():
+			pos = np.searchsorted(user_ids, user_id)
+			if pos < len(user_ids) and user_ids[pos] == user_id:
+				user_factors[pos] = factor
+			else:
+				user_ids = np.insert(user_ids, pos, user_id)
+				user_factors = np.insert(user_factors, pos, factor, axis=0)
+
+		return save_factors(
+			output_dir=output_dir,
+			model=self,
+			model_type="als",
+			user_ids=user_ids,
+			user_factors=user_factors,
+			item_ids=item_ids,
+			item_factors=item_factors
+			)
+
+	@classmethod
+	def load_model(cls, input_dir, mmap=True):
+		"""
+		input_dir: directory from save_model
+		mmap: whether or not to memory-map saved arrays
+
+		return numpy_als_model.Model holding the saved factors, ready to predict without train
+			scoring with saved factors doesn't need spark
 		"""
-		pass
\ No newline at end of file
+		return NumpyAlsModel.load_model(input_dir, mmap=mmap)
\ No newline at end of file
@@ -1,6 +1,8 @@
 import pandas as pd
 from main.constants import *
-from main.model.model_utils import init_user_item
+from main.model.model_utils import init_user_item, init_users_items, top_k, top_k_per_user
+from main.model.model_utils import get_model_dir, save_model_state, load_model_state
+from main.model.model_utils import dataframe_to_arrays, arrays_to_dataframe, replace_user_reviews
 
 def rank_restaurants_by_rates(data):
 	"""
@@ -35,6 +37,7 @@ class Model:
 		"""
 		user_id: 
 			this model is for a specific user
+			None for a model shared by all users in data_reviews
 
 		model_name: 
 			give this model a name
@@ -59,24 +62,87 @@ class Model:
 		self.item_counts = rank_restaurants_by_rates(self.data)
 
 
-	def predict(self, k=10, removeSeen=True):
+	def predict(self, k=10, removeSeen=True, user_id=None, seen_items=None):
 		"""
 		predict top 10 restaurants on user
 
 		if k <= 0, return all predictions
+		user_id: user to predict on, default to self.user
+			a shared model can predict on any user in its data
+		seen_items: more items to remove before selection if removeSeen
 		"""
-		user_item = init_user_item(user_id=self.user, data=self.data, removeSeen=removeSeen)
-		baseline_recommendations = get_prediction(self.item_counts, user_item)
-		res = baseline_recommendations[baseline_recommendations[COL_USER] == self.user] \
-				.sort_values(COL_PREDICTION, ascending=False)
+		if user_id is None:
+			user_id = self.user
 
-		if k <= 0:
-			return res
-		else:
-			return res.head(k)
+		user_item = init_user_item(
+			user_id=user_id,
+			data=self.data,
+			removeSeen=removeSeen,
+			seen_items=seen_items
+			)
+		return top_k(get_prediction(self.item_counts, user_item), k)
+
+	def predict_many(self, user_ids, k=10, removeSeen=True, seen_pairs=None):
+		"""
+		predict top k restaurants on each user in user_ids in one pass
+
+		if k <= 0, return all predictions
+		return pandas dataframe of predictions sorted by user then prediction
+		seen_pairs: pandas dataframe of more user_item pairs to remove before selection if removeSeen
+		"""
+		user_item = init_users_items(
+			user_ids=user_ids,
+			data=self.data,
+			removeSeen=removeSeen,
+			seen_pairs=seen_pairs
+			)
+		return top_k_per_user(get_prediction(self.item_counts, user_item), k)
+
+	def fold_in_user(self, user_id, user_reviews):
+		"""
+		update one user from current ratings without retrain
+		baseline scores don't depend on user, only seen items are updated
+
+		user_id: user to update
+		user_reviews: pandas dataframe of all current reviews of user_id
+		"""
+		self.data = replace_user_reviews(self.data, user_id, user_reviews)
 
 	def save_model(self, output_dir):
 		"""
 		save this model under output_dir with self.<model_name>_<current_time>
+		return directory of saved model, see load_model
+		"""
+		model_dir = get_model_dir(output_dir, self.name)
+
+		arrays = dataframe_to_arrays(self.data, "data.")
+		arrays.update(dataframe_to_arrays(self.item_counts, "item_counts."))
+
+		save_model_state(
+			model_dir,
+			header={
+				"model" : "baseline",
+				"user" : None if self.user is None else int(self.user),
+				"name" : self.name
+			},
+			arrays=arrays
+			)
+		return model_dir
+
+	@classmethod
+	def load_model(cls, input_dir, mmap=True):
+		"""
+		input_dir: directory from save_model
+		mmap: whether or not to memory-map saved arrays
+
+		return trained model, ready to predict without train
 		"""
-		pass
\ No newline at end of file
+		header, arrays = load_model_state(input_dir, mmap=mmap)
+
+		model = cls(
+			user_id=header["user"],
+			model_name=header["name"],
+			data_reviews=arrays_to_dataframe(arrays, "data.")
+			)
+		model.item_counts = arrays_to_dataframe(arrays, "item_counts.")
+		return model
\ No newline at end of file
@@ -1,11 +1,51 @@
+import os
+import json
+import numpy as np
 import pandas as pd
-import itertools
+from datetime import datetime
 from main.constants import *
 
+def init_user_item_arrays(
+	user_id,
+	data,
+	removeSeen=True,
+	seen_items=None,
+	items=None,
+	user_seen=None
+	):
+	"""
+	generate user_item candidates given user_id and data, as typed numpy arrays
+
+	user_id: user id for this user
+	data: pandas dataframe of relevant reviews
+	removeSeen: whether or not to remove seen data
+	seen_items: more items to remove if removeSeen, e.g. seen out of data
+	items: candidate items, default to unique items in data
+	user_seen: precomputed items user_id rated in data, default to scan data
+
+	return (users, items) numpy arrays of candidate pairs, items sorted
+	"""
+	if items is None:
+		items = np.unique(data[COL_ITEM].to_numpy())
+
+	if removeSeen:
+		if user_seen is None:
+			user_seen = data[COL_ITEM].to_numpy()[data[COL_USER].to_numpy() == user_id]
+		if seen_items is not None:
+			user_seen = np.concatenate((user_seen, np.asarray(seen_items, dtype=user_seen.dtype)))
+		items = np.setdiff1d(items, user_seen)
+
+	items = np.asarray(items).astype(REVIEW_DTYPES[COL_ITEM], copy=False)
+	users = np.full(len(items), user_id, dtype=REVIEW_DTYPES[COL_USER])
+	return users, items
+
 def init_user_item(
 	user_id,
 	data,
-	removeSeen=True
+	removeSeen=True,
+	seen_items=None,
+	items=None,
+	user_seen=None
 	):
 	"""
 	generate user_item candidates given user_id and data
@@ -13,24 +53,244 @@ def init_user_item(
 	user_id: user id for this user
 	data: pandas dataframe of relevant reviews
 	removeSeen: whether or not to remove seen data
+	seen_items: more items to remove if removeSeen, e.g. seen out of data
+	items: candidate items, default to unique items in data
+	user_seen: precomputed items user_id rated in data, default to scan data
 
 	return pandas dataframe of user_item candidate pairs
 	"""
-	users = [user_id]
-	items = data[COL_ITEM].unique()
-	user_item_columns = [COL_USER, COL_ITEM]
-	user_item_all = pd.DataFrame(
-		list(itertools.product(users, items)),
-		columns=user_item_columns
+	users, items = init_user_item_arrays(
+		user_id=user_id,
+		data=data,
+		removeSeen=removeSeen,
+		seen_items=seen_items,
+		items=items,
+		user_seen=user_seen
 		)
+	return pd.DataFrame({COL_USER : users, COL_ITEM : items}, copy=False)
 
-	if removeSeen:
-		user_item = user_item_all.loc[ 
-						~user_item_all.set_index(user_item_columns).index.isin( 
-							data.set_index(user_item_columns).index 
-						)
-					]
+def init_users_items_arrays(
+	user_ids,
+	data,
+	removeSeen=True,
+	seen_pairs=None,
+	items=None
+	):
+	"""
+	generate user_item candidates for many users at once, as typed numpy arrays
+
+	user_ids: list of user ids
+	data: pandas dataframe of relevant reviews
+	removeSeen: whether or not to remove seen data
+	seen_pairs: pandas dataframe of more user_item pairs to remove if removeSeen
+	items: candidate items, default to unique items in data
+
+	return (users, items) numpy arrays of candidate pairs, grouped by user in order of user_ids
+		each user appears once even if repeated in user_ids
+	"""
+	users = np.asarray(user_ids).astype(REVIEW_DTYPES[COL_USER], copy=False)
+	users = users[np.sort(np.unique(users, return_index=True)[1])]
+	if items is None:
+		items = np.unique(data[COL_ITEM].to_numpy())
+	items = np.asarray(items).astype(REVIEW_DTYPES[COL_ITEM], copy=False)
+
+	# candidate pair (users[i], items[j]) is at i * len(items) + j
+	keep = np.ones(len(users) * len(items), dtype=bool)
+	if removeSeen and len(keep) > 0:
+		seen = [data]
+		if seen_pairs is not None:
+			seen.append(seen_pairs)
+
+		user_order = np.argsort(users, kind="stable")
+		sorted_users = users[user_order]
+		for pairs in seen:
+			seen_users = pairs[COL_USER].to_numpy()
+			seen_items = pairs[COL_ITEM].to_numpy()
+
+			user_pos = np.minimum(np.searchsorted(sorted_users, seen_users), len(users) - 1)
+			item_pos = np.minimum(np.searchsorted(items, seen_items), len(items) - 1)
+			known = (sorted_users[user_pos] == seen_users) & (items[item_pos] == seen_items)
+
+			keep[user_order[user_pos[known]] * len(items) + item_pos[known]] = False
+
+	candidates = np.flatnonzero(keep)
+	return users[candidates // len(items)], items[candidates % len(items)]
+
+def init_users_items(
+	user_ids,
+	data,
+	removeSeen=True,
+	seen_pairs=None,
+	items=None
+	):
+	"""
+	generate user_item candidates for many users at once
+
+	user_ids: list of user ids
+	data: pandas dataframe of relevant reviews
+	removeSeen: whether or not to remove seen data
+	seen_pairs: pandas dataframe of more user_item pairs to remove if removeSeen
+	items: candidate items, default to unique items in data
+
+	return pandas dataframe of user_item candidate pairs, grouped by user in order of user_ids
+	"""
+	users, items = init_users_items_arrays(
+		user_ids=user_ids,
+		data=data,
+		removeSeen=removeSeen,
+		seen_pairs=seen_pairs,
+		items=items
+		)
+	return pd.DataFrame({COL_USER : users, COL_ITEM : items}, copy=False)
+
+def top_k(pred, k):
+	"""
+	pred: pandas dataframe of predictions with COL_PREDICTION
+
+	return top k rows by COL_PREDICTION with index reset to rank
+		same rows and order as stable sort then head(k), in linear time by partial selection
+	if k <= 0, return all predictions sorted
+	"""
+	scores = pred[COL_PREDICTION].to_numpy()
+
+	# NaN scores sort last, as in stable sort
+	is_nan = np.isnan(scores)
+	num_valid = len(scores) - int(is_nan.sum())
+
+	if k <= 0 or k >= len(scores):
+		order = np.argsort(-scores, kind="stable")
+	elif k >= num_valid:
+		valid = np.flatnonzero(~is_nan)
+		order = valid[np.argsort(-scores[valid], kind="stable")]
+		order = np.concatenate((order, np.flatnonzero(is_nan)[:k - num_valid]))
+	else:
+		# kth best valid score, all better rows and earliest rows tied with it are kept
+		kth = -np.partition(-scores[~is_nan], k - 1)[k - 1]
+		better = np.flatnonzero(scores > kth)
+		tied = np.flatnonzero(scores == kth)[:k - len(better)]
+		order = np.concatenate((better, tied))
+		order = order[np.lexsort((order, -scores[order]))]
+
+	return pred.iloc[order].reset_index(drop=True)
+
+def top_k_per_user(pred, k):
+	"""
+	pred: pandas dataframe of predictions with COL_USER and COL_PREDICTION
+
+	return top k rows by COL_PREDICTION for each user, sorted by user then prediction
+	if k <= 0, return all predictions
+	"""
+	pred = pred.sort_values(
+		[COL_USER, COL_PREDICTION],
+		ascending=[True, False],
+		kind="stable"
+		)
+
+	if k <= 0:
+		return pred
 	else:
-		user_item = user_item_all
+		return pred.groupby(COL_USER, sort=False).head(k)
+
+def get_model_dir(output_dir, model_name):
+	"""
+	return new empty directory to save model, output_dir/<model_name>_<current_time>/
+		current time has microseconds, _<n> is appended if directory already exists
+		directory is created here so models saved at same time never share it
+	"""
+	model_dir = "{}{}_{}".format(
+		output_dir,
+		model_name,
+		datetime.today().strftime('%Y-%m-%d-%H:%M:%S.%f')
+		)
+
+	os.makedirs(output_dir or ".", exist_ok=True)
+	suffix = ""
+	count = 0
+	while True:
+		try:
+			os.mkdir(model_dir + suffix)
+			return model_dir + suffix + "/"
+		except FileExistsError:
+			count += 1
+			suffix = f"_{count}"
+
+def save_model_state(model_dir, header, arrays=None):
+	"""
+	model_dir: directory to save model state
+	header: json serializable state, e.g. user, name and hyperparameters
+	arrays: mapping from name to numpy array of learned state
+
+	output:
+		header.json: version, header, (name, dtype, shape) of each array
+		<name>.npy: one array per learned state, can be memory-mapped on load
+	"""
+	if arrays is None:
+		arrays = dict()
+
+	os.makedirs(os.path.dirname(model_dir), exist_ok=True)
+	for (name, array) in arrays.items():
+		np.save(model_dir + name + ".npy", np.ascontiguousarray(array))
 
-	return user_item
\ No newline at end of file
+	item = dict(header)
+	item["version"] = MODEL_VERSION
+	item["arrays"] = [[name, str(array.dtype), list(array.shape)] for (name, array) in arrays.items()]
+
+	# header is written last, so a half written model can't be loaded
+	with open(model_dir + MODEL_HEADER, "w") as file:
+		file.write(json.dumps(item))
+
+def load_model_state(model_dir, mmap=True):
+	"""
+	model_dir: directory of model saved by save_model_state
+	mmap: whether or not to memory-map the arrays instead of reading them
+
+	output:
+		header: mapping loaded from header.json
+		arrays: mapping from name to numpy array
+	"""
+	with open(model_dir + MODEL_HEADER, "r") as file:
+		header = json.load(file)
+
+	if header["version"] != MODEL_VERSION:
+		raise ValueError("{} has version {}, expect {}".format(
+			model_dir,
+			header["version"],
+			MODEL_VERSION
+			))
+
+	arrays = dict()
+	for [name, dtype, shape] in header["arrays"]:
+		array = np.load(model_dir + name + ".npy", mmap_mode="r" if mmap else None)
+		if array.dtype != np.dtype(dtype) or list(array.shape) != shape:
+			raise ValueError("{}{}.npy doesn't match header".format(model_dir, name))
+		arrays[name] = array
+
+	return header, arrays
+
+def dataframe_to_arrays(df, prefix):
+	"""
+	return mapping from prefix + column name to numpy array of each column in df
+	"""
+	return {prefix + col : df[col].to_numpy() for col in df.columns}
+
+def arrays_to_dataframe(arrays, prefix):
+	"""
+	return pandas dataframe of arrays saved by dataframe_to_arrays, columns are not copied
+	"""
+	return pd.DataFrame(
+		{name[len(prefix):] : array for (name, array) in arrays.items() if name.startswith(prefix)},
+		copy=False
+		)
+
+def replace_user_reviews(data, user_id, user_reviews):
+	"""
+	data: pandas dataframe of reviews
+	user_id: user to replace reviews
+	user_reviews: pandas dataframe of all current reviews of user_id
+
+	return data with reviews of user_id replaced by user_reviews
+	"""
+	return pd.concat(
+		[data[data[COL_USER] != user_id], user_reviews[data.columns]],
+		ignore_index=True
+		)
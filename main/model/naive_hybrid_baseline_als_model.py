@@ -1,7 +1,21 @@
+import os
 import pandas as pd
 from main.constants import *
 from main.model.als_model import Model as AlsModel
+from main.model.numpy_als_model import Model as NumpyAlsModel
 from main.model.baseline_model import rank_restaurants_by_rates
+from main.model.model_utils import get_model_dir, save_model_state, load_model_state
+from main.model.model_utils import dataframe_to_arrays, arrays_to_dataframe, replace_user_reviews
+
+def weight_by_item_counts(item_counts, data):
+	"""
+	helper function
+	return reviews in data with rating weighted by num of ratings of item
+	reviews on items not in item_counts are dropped
+	"""
+	df = pd.merge(item_counts, data, on=[COL_ITEM], how='inner')
+	df["result"] = df[COL_RATING] * df[COL_PREDICTION]
+	return df[[COL_USER, COL_ITEM, "result", COL_TIMESTAMP]].rename(columns={"result" : COL_RATING})
 
 class Model:
 	"""
@@ -11,11 +25,14 @@ class Model:
 		self.data
 		self.<hyperparameter_name> ...
 	"""
+	# als model trained on count weighted ratings
+	inner_model_class = AlsModel
 
 	def __init__(self, user_id, model_name, data_reviews):
 		"""
 		user_id: 
 			this model is for a specific user
+			None for a model shared by all users in data_reviews
 
 		model_name: 
 			give this model a name
@@ -27,12 +44,10 @@ class Model:
 		self.name = model_name
 		self.data = data_reviews
 
-		item_counts = rank_restaurants_by_rates(self.data)
-		df = pd.merge(item_counts, self.data, on=[COL_ITEM], how='inner')
-		df["result"] = df[COL_RATING] * df[COL_PREDICTION]
-		df = df[[COL_USER, COL_ITEM, "result", COL_TIMESTAMP]].rename(columns={"result" : COL_RATING})
+		self.item_counts = rank_restaurants_by_rates(self.data)
+		df = weight_by_item_counts(self.item_counts, self.data)
 
-		self.model = AlsModel(
+		self.model = self.inner_model_class(
 			user_id=self.user,
 			model_name=f"{self.name}_als",
 			data_reviews=df
@@ -50,16 +65,109 @@ class Model:
 		"""
 		self.model.train()
 
-	def predict(self, k=10, removeSeen=True):
+	def warm_start(self, model):
+		"""
+		model: trained model of same class, e.g. on an earlier prefix of same data
+
+		next train of inner model starts from state of model's inner model
+		no effect if inner model can't warm start
+		"""
+		if hasattr(self.model, "warm_start"):
+			self.model.warm_start(model.model)
+
+	def predict(self, k=10, removeSeen=True, user_id=None, seen_items=None):
 		"""
 		predict top 10 restaurants on user
 
 		if k <= 0, return all predictions
+		user_id: user to predict on, default to self.user
+			a shared model can predict on any user in its data
+		seen_items: more items to remove before selection if removeSeen
+		"""
+		if user_id is None:
+			user_id = self.user
+
+		return self.model.predict(
+			k=k,
+			removeSeen=removeSeen,
+			user_id=user_id,
+			seen_items=seen_items
+			)
+
+	def predict_many(self, user_ids, k=10, removeSeen=True, seen_pairs=None):
+		"""
+		predict top k restaurants on each user in user_ids in one pass
+
+		if k <= 0, return all predictions
+		return pandas dataframe of predictions sorted by user then prediction
+		seen_pairs: pandas dataframe of more user_item pairs to remove before selection if removeSeen
+		"""
+		return self.model.predict_many(
+			user_ids=user_ids,
+			k=k,
+			removeSeen=removeSeen,
+			seen_pairs=seen_pairs
+			)
+
+	def fold_in_user(self, user_id, user_reviews):
+		"""
+		update one user from current ratings without retrain, item counts are kept
+
+		user_id: user to update
+		user_reviews: pandas dataframe of all current reviews of user_id
+
+		return factor of user_id in inner model
 		"""
-		return self.model.predict(k=k, removeSeen=removeSeen)
+		self.data = replace_user_reviews(self.data, user_id, user_reviews)
+		return self.model.fold_in_user(
+			user_id,
+			weight_by_item_counts(self.item_counts, user_reviews)
+			)
 
 	def save_model(self, output_dir):
 		"""
 		save this model under output_dir with self.<model_name>_<current_time>
+		return directory of saved model, see load_model
+		"""
+		model_dir = get_model_dir(output_dir, self.name)
+		inner_dir = self.model.save_model(model_dir)
+
+		save_model_state(
+			model_dir,
+			header={
+				"model" : "nhba",
+				"user" : None if self.user is None else int(self.user),
+				"name" : self.name,
+				"inner_model" : os.path.basename(os.path.dirname(inner_dir))
+			},
+			arrays=dataframe_to_arrays(self.data, "data.")
+			)
+		return model_dir
+
+	@classmethod
+	def load_model(cls, input_dir, mmap=True):
+		"""
+		input_dir: directory from save_model
+		mmap: whether or not to memory-map saved arrays
+
+		return trained model, ready to predict without train
 		"""
-		pass
\ No newline at end of file
+		header, arrays = load_model_state(input_dir, mmap=mmap)
+
+		# skip __init__, inner model is loaded instead of built
+		model = cls.__new__(cls)
+		model.user = header["user"]
+		model.name = header["name"]
+		model.data = arrays_to_dataframe(arrays, "data.")
+		model.item_counts = rank_restaurants_by_rates(model.data)
+		model.model = cls.inner_model_class.load_model(
+			input_dir + header["inner_model"] + "/",
+			mmap=mmap
+			)
+		return model
+
+class NumpyModel(Model):
+	"""
+	same as Model, with als model in numpy instead of spark
+	"""
+	inner_model_class = NumpyAlsModel
@@ -0,0 +1,483 @@
+import numpy as np
+import pandas as pd
+
+from main.constants import *
+from main.model.model_utils import init_user_item, init_users_items, top_k, top_k_per_user
+from main.model.model_utils import get_model_dir, save_model_state, load_model_state
+from main.model.model_utils import dataframe_to_arrays, arrays_to_dataframe, replace_user_reviews
+
+#-------------------------------
+# Constants
+#-------------------------------
+MAX_BATCH_NNZ = 1 << 16
+# max num of ratings in one batch of least squares, bounds memory of rank x rank blocks
+
+#-------------------------------
+# Helper Functions
+#-------------------------------
+def build_csr(rows, cols, vals, num_rows):
+	"""
+	helper function
+	rows: numpy array of row index of each rating
+	cols: numpy array of col index of each rating
+	vals: numpy array of each rating
+	num_rows: num of rows in matrix
+
+	return (indptr, indices, data) of csr matrix, ratings of each row keep original order
+	"""
+	order = np.argsort(rows, kind="stable")
+	indptr = np.zeros(num_rows + 1, dtype=np.int64)
+	np.cumsum(np.bincount(rows, minlength=num_rows), out=indptr[1:])
+	return indptr, cols[order], vals[order]
+
+def init_factors(num_rows, rank, rng, nonnegative):
+	"""
+	helper function
+	return random factors of unit length, same as spark ALS
+	"""
+	factors = rng.standard_normal((num_rows, rank))
+	if nonnegative:
+		factors = np.abs(factors)
+	factors /= np.linalg.norm(factors, axis=1, keepdims=True)
+	return factors
+
+def copy_known_factors(ids, factors, known_ids, known_factors):
+	"""
+	helper function
+	return factors with rows of ids found in known_ids replaced by known_factors
+
+	ids, known_ids: sorted unique ids of rows
+	"""
+	if len(known_ids) == 0:
+		return factors
+
+	pos = np.minimum(np.searchsorted(known_ids, ids), len(known_ids) - 1)
+	found = known_ids[pos] == ids
+	factors[found] = known_factors[pos[found]]
+	return factors
+
+def solve_masked(A, b, passive):
+	"""
+	helper function
+	solve batch of A x = b on passive variables only, other variables are 0
+	"""
+	rank = A.shape[1]
+	A = np.where(passive[:, :, None] & passive[:, None, :], A, 0) + np.eye(rank) * (~passive)[:, :, None]
+	b = np.where(passive, b, 0)
+	return np.linalg.solve(A, b[:, :, None])[:, :, 0]
+
+def solve_nnls(A, b):
+	"""
+	helper function
+	lawson-hanson active set on batch of min 0.5 x'Ax - b'x subject to x >= 0
+
+	A: batch of positive definite matrices, shape (n, rank, rank)
+	b: shape (n, rank)
+
+	return nonnegative solutions
+	"""
+	n, rank = b.shape
+	tol = 1e-10 * max(np.abs(b).max(initial=0), 1.0)
+
+	x = np.linalg.solve(A, b[:, :, None])[:, :, 0]
+
+	# rows with nonnegative unconstrained solution are done
+	rows = np.flatnonzero((x < 0).any(axis=1))
+	if len(rows) == 0:
+		return x
+
+	A_rows = A[rows]
+	b_rows = b[rows]
+
+	# warm start from positive part of unconstrained solution, which is feasible
+	passive = x[rows] > tol
+	x_rows = np.where(passive, x[rows], 0)
+	active = np.arange(len(rows))
+
+	for i in range(3 * rank):
+		# step back towards feasible until solution on passive set is nonnegative
+		for j in range(3 * rank):
+			s = solve_masked(A_rows[active], b_rows[active], passive[active])
+			infeasible = passive[active] & (s <= 0)
+			stepping = infeasible.any(axis=1)
+			if not stepping.any():
+				break
+
+			stepping_rows = active[stepping]
+			x_step = x_rows[stepping_rows]
+			s_step = s[stepping]
+			with np.errstate(divide="ignore", invalid="ignore"):
+				alpha = np.where(infeasible[stepping], x_step / (x_step - s_step), np.inf).min(axis=1)
+			x_step += alpha[:, None] * (s_step - x_step)
+
+			passive[stepping_rows] &= x_step > tol
+			x_rows[stepping_rows] = np.where(passive[stepping_rows], x_step, 0)
+
+		x_rows[active] = s
+
+		# move variable with most negative gradient into passive set
+		gradient = b_rows[active] - np.einsum("nij,nj->ni", A_rows[active], x_rows[active])
+		gradient[passive[active]] = -np.inf
+		best = np.argmax(gradient, axis=1)
+		improving = gradient[np.arange(len(active)), best] > tol
+		active, best = active[improving], best[improving]
+		if len(active) == 0:
+			break
+		passive[active, best] = True
+
+	x[rows] = x_rows
+	return x
+
+def solve_factors(indptr, indices, ratings, fixed, regParam, nonnegative):
+	"""
+	helper function
+	solve factors of each row with fixed factors of other side, in batches of rows
+
+	indptr, indices, ratings: csr matrix of ratings
+	fixed: factors of columns
+	regParam: regularization, scaled by num of ratings of each row
+
+	return factors of rows, rows without ratings are zeros
+	"""
+	num_rows = len(indptr) - 1
+	rank = fixed.shape[1]
+	factors = np.zeros((num_rows, rank))
+	eye = np.eye(rank)
+
+	start = 0
+	while start < num_rows:
+		end = np.searchsorted(indptr, indptr[start] + MAX_BATCH_NNZ, side="right") - 1
+		end = min(max(end, start + 1), num_rows)
+
+		counts = np.diff(indptr[start:end + 1])
+		nonempty = counts > 0
+		if nonempty.any():
+			low, high = indptr[start], indptr[end]
+			V = fixed[indices[low:high]]
+			r = ratings[low:high]
+			row_starts = indptr[start:end][nonempty] - low
+
+			# normal equations of each row, A = V'V + regParam * n * I, b = V'r
+			A = np.add.reduceat(V[:, :, None] * V[:, None, :], row_starts, axis=0)
+			A += regParam * counts[nonempty][:, None, None] * eye
+			b = np.add.reduceat(V * r[:, None], row_starts, axis=0)
+
+			if nonnegative:
+				x = solve_nnls(A, b)
+			else:
+				x = np.linalg.solve(A, b[:, :, None])[:, :, 0]
+
+			factors[start:end][nonempty] = x
+
+		start = end
+
+	return factors
+
+def fold_in_factor(item_ids, item_factors, user_reviews, regParam, nonnegative):
+	"""
+	helper function
+	solve factor of a user with fixed item factors, same least squares as a step of train
+
+	item_ids: sorted feature_ids of item_factors
+	item_factors: trained item factors
+	user_reviews: pandas dataframe of reviews of the user
+		items not in item_ids are ignored
+
+	return factor of the user
+	"""
+	rank = item_factors.shape[1]
+	items = user_reviews[COL_ITEM].to_numpy()
+	ratings = user_reviews[COL_RATING].to_numpy(dtype=np.float64)
+
+	item_pos = np.minimum(np.searchsorted(item_ids, items), len(item_ids) - 1)
+	known = item_ids[item_pos] == items if len(item_ids) > 0 else np.zeros(len(items), dtype=bool)
+	if not known.any():
+		return np.zeros(rank)
+
+	V = item_factors[item_pos[known]].astype(np.float64)
+	A = V.T @ V + regParam * known.sum() * np.eye(rank)
+	b = V.T @ ratings[known]
+
+	if nonnegative:
+		return solve_nnls(A[None], b[None])[0]
+	else:
+		return np.linalg.solve(A, b)
+
+def score_user_item(user_item, user_ids, user_factors, item_ids, item_factors):
+	"""
+	helper function
+	user_item: pandas dataframe of user_item pairs
+	user_ids, item_ids: sorted ids of user_factors, item_factors
+
+	return user_item with COL_PREDICTION
+		pairs with user or item not in ids are dropped, same as coldStartStrategy drop
+	"""
+	users = user_item[COL_USER].to_numpy()
+	items = user_item[COL_ITEM].to_numpy()
+	if len(user_ids) == 0 or len(item_ids) == 0:
+		return user_item.iloc[:0].assign(**{COL_PREDICTION : np.zeros(0, dtype=np.float32)})
+
+	user_pos = np.minimum(np.searchsorted(user_ids, users), len(user_ids) - 1)
+	item_pos = np.minimum(np.searchsorted(item_ids, items), len(item_ids) - 1)
+	known = (user_ids[user_pos] == users) & (item_ids[item_pos] == items)
+
+	pred = user_item.loc[known].copy()
+	pred[COL_PREDICTION] = np.einsum(
+		"ij,ij->i",
+		user_factors[user_pos[known]],
+		item_factors[item_pos[known]]
+		).astype(np.float32)
+	return pred
+
+def save_factors(
+	output_dir,
+	model,
+	model_type,
+	user_ids,
+	user_factors,
+	item_ids,
+	item_factors
+	):
+	"""
+	helper function
+	save data, hyperparameters and factors of an ALS model, loaded by Model.load_model
+
+	ids are sorted, row i of factors is factor of ids[i]
+	return directory of saved model
+	"""
+	model_dir = get_model_dir(output_dir, model.name)
+
+	arrays = dataframe_to_arrays(model.data, "data.")
+	arrays["user_ids"] = user_ids
+	arrays["user_factors"] = user_factors
+	arrays["item_ids"] = item_ids
+	arrays["item_factors"] = item_factors
+
+	save_model_state(
+		model_dir,
+		header={
+			"model" : model_type,
+			"user" : None if model.user is None else int(model.user),
+			"name" : model.name,
+			"params" : {
+				"maxIter" : model.maxIter,
+				"rank" : model.rank,
+				"regParam" : model.regParam,
+				"nonnegative" : model.nonnegative,
+				"seed" : model.seed
+			}
+		},
+		arrays=arrays
+		)
+	return model_dir
+
+class Model:
+	"""
+	explicit feedback ALS in numpy, same hyperparameters as als_model
+
+	state:
+		self.user
+		self.name
+		self.data
+		self.user_ids : sorted unique int_user_id, row of user factors
+		self.item_ids : sorted unique feature_id, row of item factors
+		self.user_factors
+		self.item_factors
+		self.warm_model : model to start next train from, see warm_start
+		self.<hyperparameter_name> ...
+	"""
+
+	def __init__(self, user_id, model_name, data_reviews):
+		"""
+		user_id:
+			this model is for a specific user
+			None for a model shared by all users in data_reviews
+
+		model_name:
+			give this model a name
+
+		data_reviews:
+			pandas dataframe where each row is review
+		"""
+		self.user = user_id
+		self.name = model_name
+		self.data = data_reviews
+
+		self.maxIter = 10
+		self.rank = 10
+		self.regParam = 0.001
+		self.nonnegative = True
+		self.seed = 42
+		self.warmStartIter = 5
+
+		self.warm_model = None
+
+	def close(self):
+		"""
+		do something when close this model
+		"""
+		pass
+
+	def train(self):
+		"""
+		train on hyperparmaters
+		"""
+		users = self.data[COL_USER].to_numpy()
+		items = self.data[COL_ITEM].to_numpy()
+		ratings = self.data[COL_RATING].to_numpy(dtype=np.float64)
+
+		self.user_ids, user_index = np.unique(users, return_inverse=True)
+		self.item_ids, item_index = np.unique(items, return_inverse=True)
+
+		user_csr = build_csr(user_index, item_index, ratings, len(self.user_ids))
+		item_csr = build_csr(item_index, user_index, ratings, len(self.item_ids))
+
+		rng = np.random.default_rng(self.seed)
+		self.user_factors = init_factors(len(self.user_ids), self.rank, rng, self.nonnegative)
+		self.item_factors = init_factors(len(self.item_ids), self.rank, rng, self.nonnegative)
+
+		num_iter = self.maxIter
+		if self.warm_model is not None:
+			self.user_factors = copy_known_factors(
+				self.user_ids, self.user_factors, self.warm_model.user_ids, self.warm_model.user_factors
+				)
+			self.item_factors = copy_known_factors(
+				self.item_ids, self.item_factors, self.warm_model.item_ids, self.warm_model.item_factors
+				)
+			num_iter = self.warmStartIter
+			self.warm_model = None
+
+		for i in range(num_iter):
+			self.item_factors = solve_factors(*item_csr, self.user_factors, self.regParam, self.nonnegative)
+			self.user_factors = solve_factors(*user_csr, self.item_factors, self.regParam, self.nonnegative)
+
+	def warm_start(self, model):
+		"""
+		model: trained model of same class, e.g. on an earlier prefix of same data
+
+		next train starts from factors of users and items known to model
+		and runs warmStartIter iterations instead of maxIter
+		"""
+		self.warm_model = model
+
+	def score(self, user_item):
+		"""
+		user_item: pandas dataframe of user_item pairs
+
+		return user_item with COL_PREDICTION
+			pairs with user or item not in training data are dropped, same as coldStartStrategy drop
+		"""
+		return score_user_item(
+			user_item,
+			self.user_ids,
+			self.user_factors,
+			self.item_ids,
+			self.item_factors
+			)
+
+	def fold_in_user(self, user_id, user_reviews):
+		"""
+		update factor of one user from current ratings, item factors are kept
+
+		user_id: user to update, added to model if not trained on
+		user_reviews: pandas dataframe of all current reviews of user_id
+
+		return factor of user_id
+		"""
+		factor = fold_in_factor(
+			self.item_ids,
+			self.item_factors,
+			user_reviews,
+			self.regParam,
+			self.nonnegative
+			)
+
+		# saved factors can be read-only memory-map, so arrays are replaced instead of written
+		pos = np.searchsorted(self.user_ids, user_id)
+		if pos < len(self.user_ids) and self.user_ids[pos] == user_id:
+			user_factors = np.array(self.user_factors)
+			user_factors[pos] = factor
+			self.user_factors = user_factors
+		else:
+			self.user_ids = np.insert(self.user_ids, pos, user_id)
+			self.user_factors = np.insert(self.user_factors, pos, factor, axis=0)
+
+		self.data = replace_user_reviews(self.data, user_id, user_reviews)
+		return factor
+
+	def predict(self, k=10, removeSeen=True, user_id=None, seen_items=None):
+		"""
+		predict top 10 restaurants on user
+
+		if k <= 0, return all predictions
+		user_id: user to predict on, default to self.user
+			a shared model can predict on any user in its data
+		seen_items: more items to remove before selection if removeSeen
+		"""
+		if user_id is None:
+			user_id = self.user
+
+		user_item = init_user_item(
+			user_id=user_id,
+			data=self.data,
+			removeSeen=removeSeen,
+			seen_items=seen_items,
+			items=self.item_ids
+			)
+		return top_k(self.score(user_item), k)
+
+	def predict_many(self, user_ids, k=10, removeSeen=True, seen_pairs=None):
+		"""
+		predict top k restaurants on each user in user_ids in one pass
+
+		if k <= 0, return all predictions
+		return pandas dataframe of predictions sorted by user then prediction
+		seen_pairs: pandas dataframe of more user_item pairs to remove before selection if removeSeen
+		"""
+		user_item = init_users_items(
+			user_ids=user_ids,
+			data=self.data,
+			removeSeen=removeSeen,
+			seen_pairs=seen_pairs,
+			items=self.item_ids
+			)
+		return top_k_per_user(self.score(user_item), k).reset_index(drop=True)
+
+	def save_model(self, output_dir):
+		"""
+		save this model under output_dir with self.<model_name>_<current_time>
+		return directory of saved model, see load_model
+		"""
+		return save_factors(
+			output_dir=output_dir,
+			model=self,
+			model_type="numpy_als",
+			user_ids=self.user_ids,
+			user_factors=self.user_factors,
+			item_ids=self.item_ids,
+			item_factors=self.item_factors
+			)
+
+	@classmethod
+	def load_model(cls, input_dir, mmap=True):
+		"""
+		input_dir: directory from save_model, of this model or als_model
+		mmap: whether or not to memory-map saved arrays
+
+		return trained model, ready to predict without train
+		"""
+		header, arrays = load_model_state(input_dir, mmap=mmap)
+
+		model = cls(
+			user_id=header["user"],
+			model_name=header["name"],
+			data_reviews=arrays_to_dataframe(arrays, "data.")
+			)
+		for (param, value) in header["params"].items():
+			setattr(model, param, value)
+
+		model.user_ids = arrays["user_ids"]
+		model.user_factors = arrays["user_factors"]
+		model.item_ids = arrays["item_ids"]
+		model.item_factors = arrays["item_factors"]
+		return model
@@ -1,7 +1,12 @@
+import os
+import numpy as np
 import pandas as pd
 from datetime import datetime, timedelta
 from main.constants import *
 from main.model.naive_hybrid_baseline_als_model import Model as NHBAModel
+from main.model.naive_hybrid_baseline_als_model import NumpyModel as NumpyNHBAModel
+from main.model.model_utils import get_model_dir, save_model_state, load_model_state
+from main.model.model_utils import dataframe_to_arrays, arrays_to_dataframe, replace_user_reviews
 
 DEFAULT_TIME_RANGE = 7
 # tuned from [1,3,7,30] on 11 users (min_rating >= 500)
@@ -14,11 +19,17 @@ class Model:
 		self.data
 		self.<hyperparameter_name> ...
 	"""
+	# naive hybrid model trained on latest ratings
+	inner_model_class = NHBAModel
+
+	# data window ends at latest rating of user, one model can't serve other users
+	user_windowed = True
 
 	def __init__(self, user_id, model_name, data_reviews):
 		"""
 		user_id: 
 			this model is for a specific user
+			None for a model shared by all users in data_reviews
 
 		model_name: 
 			give this model a name
@@ -32,13 +43,17 @@ class Model:
 
 		self.latest_rating_range = timedelta(days = DEFAULT_TIME_RANGE)
 
-		last_valid_time = data_reviews[data_reviews[COL_USER] == user_id] \
-					.sort_values(COL_TIMESTAMP, ascending=False) \
-					.iloc[0][COL_TIMESTAMP] - self.latest_rating_range.total_seconds()
+		# window ends at latest rating of user, or latest rating in data for shared model
+		if user_id is None:
+			latest_time = data_reviews[COL_TIMESTAMP].max()
+		else:
+			latest_time = data_reviews[data_reviews[COL_USER] == user_id][COL_TIMESTAMP].max()
+
+		last_valid_time = latest_time - self.latest_rating_range.total_seconds()
 
 		df = data_reviews[data_reviews[COL_TIMESTAMP] >= last_valid_time]
 
-		self.model = NHBAModel(
+		self.model = self.inner_model_class(
 			user_id=self.user,
 			model_name=f"{self.name}_nhba",
 			data_reviews=df
@@ -56,31 +71,129 @@ class Model:
 		"""
 		self.model.train()
 
-	def predict(self, k=10, removeSeen=True):
+	def warm_start(self, model):
+		"""
+		model: trained model of same class, e.g. on an earlier prefix of same data
+
+		next train of inner model starts from state of model's inner model
+		no effect if inner model can't warm start
+		"""
+		if hasattr(self.model, "warm_start"):
+			self.model.warm_start(model.model)
+
+	def predict(self, k=10, removeSeen=True, user_id=None, seen_items=None):
 		"""
 		predict top 10 restaurants on user
 
 		if k <= 0, return all predictions
+		user_id: user to predict on, default to self.user
+			a shared model can predict on any user in its data
+		seen_items: more items to remove before selection if removeSeen
 		"""
+		if user_id is None:
+			user_id = self.user
+
 		if not removeSeen:
-			return self.model.predict(k=k, removeSeen=removeSeen)
+			return self.model.predict(k=k, removeSeen=removeSeen, user_id=user_id)
+
+		# inner model only saw ratings in time range, so seen items out of range are removed too
+		seen = self.data.loc[self.data[COL_USER] == user_id, COL_ITEM].unique()
+		if seen_items is not None:
+			seen = np.union1d(seen, seen_items)
+
+		return self.model.predict(
+			k=k,
+			removeSeen=removeSeen,
+			user_id=user_id,
+			seen_items=seen
+			)
 
-		naive_pred = self.model.predict(k=0, removeSeen=removeSeen)
+	def predict_many(self, user_ids, k=10, removeSeen=True, seen_pairs=None):
+		"""
+		predict top k restaurants on each user in user_ids in one pass
 
-		user_item_columns = [COL_USER, COL_ITEM]
-		pred = naive_pred.loc[
-					~naive_pred.set_index(user_item_columns).index.isin( 
-						self.data.set_index(user_item_columns).index
-					)
-				]
+		if k <= 0, return all predictions
+		return pandas dataframe of predictions sorted by user then prediction
+		seen_pairs: pandas dataframe of more user_item pairs to remove before selection if removeSeen
+		"""
+		if not removeSeen:
+			return self.model.predict_many(user_ids=user_ids, k=k, removeSeen=removeSeen)
+
+		# inner model only saw ratings in time range, so seen items out of range are removed too
+		seen = self.data.loc[self.data[COL_USER].isin(user_ids), [COL_USER, COL_ITEM]]
+		if seen_pairs is not None:
+			seen = pd.concat([seen, seen_pairs[[COL_USER, COL_ITEM]]], ignore_index=True)
+
+		return self.model.predict_many(
+			user_ids=user_ids,
+			k=k,
+			removeSeen=removeSeen,
+			seen_pairs=seen
+			)
 
-		if k <= 0:
-			return pred
-		else:
-			return pred.head(k)
+	def fold_in_user(self, user_id, user_reviews):
+		"""
+		update one user from current ratings without retrain
+
+		user_id: user to update
+		user_reviews: pandas dataframe of all current reviews of user_id
+			only ratings in time range before latest rating of user are folded in
+
+		return factor of user_id in inner model
+		"""
+		self.data = replace_user_reviews(self.data, user_id, user_reviews)
+
+		last_valid_time = user_reviews[COL_TIMESTAMP].max() - self.latest_rating_range.total_seconds()
+		return self.model.fold_in_user(
+			user_id,
+			user_reviews[user_reviews[COL_TIMESTAMP] >= last_valid_time]
+			)
 
 	def save_model(self, output_dir):
 		"""
 		save this model under output_dir with self.<model_name>_<current_time>
+		return directory of saved model, see load_model
 		"""
-		pass
\ No newline at end of file
+		model_dir = get_model_dir(output_dir, self.name)
+		inner_dir = self.model.save_model(model_dir)
+
+		save_model_state(
+			model_dir,
+			header={
+				"model" : "tbh",
+				"user" : None if self.user is None else int(self.user),
+				"name" : self.name,
+				"latest_rating_range" : self.latest_rating_range.total_seconds(),
+				"inner_model" : os.path.basename(os.path.dirname(inner_dir))
+			},
+			arrays=dataframe_to_arrays(self.data, "data.")
+			)
+		return model_dir
+
+	@classmethod
+	def load_model(cls, input_dir, mmap=True):
+		"""
+		input_dir: directory from save_model
+		mmap: whether or not to memory-map saved arrays
+
+		return trained model, ready to predict without train
+		"""
+		header, arrays = load_model_state(input_dir, mmap=mmap)
+
+		# skip __init__, inner model is loaded instead of built
+		model = cls.__new__(cls)
+		model.user = header["user"]
+		model.name = header["name"]
+		model.data = arrays_to_dataframe(arrays, "data.")
+		model.latest_rating_range = timedelta(seconds=header["latest_rating_range"])
+		model.model = cls.inner_model_class.load_model(
+			input_dir + header["inner_model"] + "/",
+			mmap=mmap
+			)
+		return model
+
+class NumpyModel(Model):
+	"""
+	same as Model, with als model in numpy instead of spark
+	"""
+	inner_model_class = NumpyNHBAModel
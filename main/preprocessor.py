@@ -1,8 +1,12 @@
 import os
 import json
 import ast
+import multiprocessing
+import numpy as np
 from datetime import datetime
 from main.constants import *
+from main.data_loader import *
+from main.feature_codec import FeatureCodec
 
 #-------------------------------
 # Constants
@@ -25,6 +29,9 @@ TIMESTAMP = "date"
 USER_ID = "user_id"
 RESTAURANT_ID = "business_id"
 
+# business_ids of restaurants, set in each review shard worker
+_shard_restaurant_ids = None
+
 #-------------------------------
 # Helper Functions
 #-------------------------------
@@ -301,7 +308,8 @@ def map_restaurant_to_feature_dict(
 	existfeature,
 	feature_separator=FEATURE_SEPARATOR,
 	default_value=DEFAULT_VAL_IF_NOT_EXIST,
-	default_boolean=False
+	default_boolean=False,
+	codec=None
 	):
 	"""
 	for input restaurant, output the feature vector given
@@ -309,8 +317,10 @@ def map_restaurant_to_feature_dict(
 		tffeature : list of true / false feature
 		valfeature : mapping from value feature to values
 		existfeature : list of exist feature
+		codec : FeatureCodec to pack the feature vector
 
 	return mapping from each feature to value
+		packed bytes of the mapping if codec is given
 	"""
 	feature_dict = dict()
 	for key in tffeature:
@@ -335,25 +345,89 @@ def map_restaurant_to_feature_dict(
 			key.split(feature_separator)
 			) is not None
 
+	if codec is not None:
+		return codec.encode(feature_dict)
+
 	return frozenset(feature_dict.items())
 
+def iter_open_restaurants(business_file):
+	"""
+	business_file: path to access business.json
+
+	yield:
+		json object of each valid open restaurant, one at a time
+		already modified by preprocess_categories, preprocess_hours_extend_workdays
+		and preprocess_attributes
+	"""
+	try:
+		with open(business_file, "r") as file:
+			for line in file:
+				business = json.loads(line)
+				if (is_valid_business(business) 
+					and is_restaurant(business) 
+					and is_open(business)):
+					# load this restaurant
+					preprocess_categories(business)
+					preprocess_hours_extend_workdays(business)
+					preprocess_attributes(business)
+
+					yield business
+	except IOError:
+		print("{} doesn't exists".format(business_file))
+
+def iter_restaurants_with_locations(
+	business_file,
+	restaurant_locations,
+	output_file=None
+	):
+	"""
+	business_file: path to access business.json
+	restaurant_locations: list to append {business_id, city} of each restaurant
+	output_file: if given, path to write each restaurant json object to
+
+	yield:
+		same restaurants as iter_open_restaurants,
+		only business_id and city are kept after each restaurant is consumed
+	"""
+	if output_file is None:
+		for restaurant in iter_open_restaurants(business_file):
+			restaurant_locations.append({
+				RESTAURANT_ID : restaurant[RESTAURANT_ID],
+				CITY : restaurant[CITY]
+				})
+			yield restaurant
+		return
+
+	with open(output_file, "w") as file:
+		for restaurant in iter_open_restaurants(business_file):
+			restaurant_locations.append({
+				RESTAURANT_ID : restaurant[RESTAURANT_ID],
+				CITY : restaurant[CITY]
+				})
+			file.write("{}\n".format(json.dumps(restaurant)))
+			yield restaurant
+
 #-------------------------------
 # APIs
 #-------------------------------
 def load_restaurants_and_features(
 	business_file,
-	feature_separator=FEATURE_SEPARATOR
+	feature_separator=FEATURE_SEPARATOR,
+	keep_restaurants=True
 	):
 	"""
 	business_file: business_file: path to access business.json 
+	keep_restaurants: whether or not to keep json objects of restaurants
+		if not, only features are collected and memory doesn't grow with business_file
 
 	return:
-		restaurants: list of json objects for each restaurants
+		restaurants: list of json objects for each restaurants, None if not keep_restaurants
 		tffeature: list of true/false features
 		valfeature: dict of value features to values
 		existfeature: list of exist featuers
 	"""
-	restaurants = list()
+	restaurants = list() if keep_restaurants else None
+	count_restaurants = 0
 	attributes = dict()
 	categories = set()
 	cities = set()
@@ -363,28 +437,16 @@ def load_restaurants_and_features(
 	start_time = [WORKDAYS_START(day) for day in workdays]
 	end_time = [WORDDAYS_END(day) for day in workdays]
 
-	try:
-		with open(business_file, "r") as file:
-			lines = file.readlines()
-			for line in lines:
-				business = json.loads(line)
-				if (is_valid_business(business) 
-					and is_restaurant(business) 
-					and is_open(business)):
-					# load this restaurant
-					preprocess_categories(business)
-					preprocess_hours_extend_workdays(business)
-					preprocess_attributes(business)
-					
-					restaurants.append(business)
+	for business in iter_open_restaurants(business_file):
+		count_restaurants += 1
+		if keep_restaurants:
+			restaurants.append(business)
 
-					add_attributes(attributes, business)
-					add_categories(categories, business)
-					add_location(cities, states, business)
-	except IOError:
-		print("{} doesn't exists".format(business_file))
+		add_attributes(attributes, business)
+		add_categories(categories, business)
+		add_location(cities, states, business)
 
-	print("distinct restaurants {}".format(len(restaurants)))
+	print("distinct restaurants {}".format(count_restaurants))
 
 	tffeature, valfeature, existfeature = init_features(
 		attributes=attributes, 
@@ -404,20 +466,26 @@ def develop_feature_ids(
 	tffeature, 
 	valfeature,
 	existfeature,
-	feature_separator=FEATURE_SEPARATOR):
+	feature_separator=FEATURE_SEPARATOR,
+	feature_vector_to_int=None,
+	restaurants_id_to_int=None,
+	codec=None):
 	"""
-	restaurants: list of restaurants json object
+	restaurants: list or iterator of restaurants json object
 	tffeature: list of true/false features
 	valfeature: dict of value features to values
 	existfeature: list of exist features
+	feature_vector_to_int: existing mapping to extend, new feature_ids continue from its max
+	restaurants_id_to_int: existing mapping to extend
+	codec: FeatureCodec to pack feature vectors, keys of feature_vector_to_int are then packed bytes
 
 	return:
-		feature_vector_to_int: mapping from feature_dict to feature_id
+		feature_vector_to_int: mapping from feature_dict (or its packed bytes) to feature_id
 		restaurants_id_to_int: mapping from business_id to feature_id
 	"""
-	feature_vector_to_int = dict()
-	restaurants_id_to_int = dict()
-	count_feature_id = 0
+	feature_vector_to_int = dict() if feature_vector_to_int is None else dict(feature_vector_to_int)
+	restaurants_id_to_int = dict() if restaurants_id_to_int is None else dict(restaurants_id_to_int)
+	count_feature_id = max(feature_vector_to_int.values(), default=0)
 
 	duplicate_restaurants = dict()
 	max_dup = 0
@@ -428,7 +496,8 @@ def develop_feature_ids(
 			tffeature,
 			valfeature,
 			existfeature,
-			feature_separator=feature_separator
+			feature_separator=feature_separator,
+			codec=codec
 			)
 
 		if feature_dict in feature_vector_to_int:
@@ -447,61 +516,195 @@ def develop_feature_ids(
 	print("Max duplicate restaurants to same feature_id: {}".format(max_dup))
 	return feature_vector_to_int, restaurants_id_to_int
 
+def find_shard_offsets(
+	input_file,
+	num_shards
+	):
+	"""
+	input_file: path to file with one record per line
+	num_shards: number of shards to split input_file into
+
+	return:
+		list of (start, end) byte offsets, each shard starts at beginning of a line
+		empty shards are dropped
+	"""
+	size = os.path.getsize(input_file)
+	offsets = [0]
+	with open(input_file, "rb") as file:
+		for i in range(1, num_shards):
+			position = size * i // num_shards
+			if position <= offsets[-1]:
+				continue
+
+			# move to the beginning of next line, unless position already is
+			file.seek(position - 1)
+			file.readline()
+			offsets.append(min(file.tell(), size))
+
+	offsets.append(size)
+	return [(offsets[i], offsets[i + 1]) for i in range(len(offsets) - 1) if offsets[i] < offsets[i + 1]]
+
+def parse_review_shard(
+	review_file,
+	start,
+	end,
+	restaurant_ids
+	):
+	"""
+	review_file: path to access review.json
+	start, end: byte range [start, end) of review_file to parse, aligned on lines
+	restaurant_ids: business_ids of restaurants to keep reviews for
+
+	return:
+		user_restaurant_timestamp_rating: mapping from user_id to mapping from business_id to latest [timestamp, rating]
+			users and restaurants are in order of first appearance in the shard
+	"""
+	user_restaurant_timestamp_rating = dict()
+
+	with open(review_file, "rb") as file:
+		file.seek(start)
+		position = start
+		for line in file:
+			if position >= end:
+				break
+			position += len(line)
+
+			line = json.loads(line)
+
+			restaurant_id = line[RESTAURANT_ID]
+			if restaurant_id not in restaurant_ids:
+				continue
+
+			rating = line[RATING]
+			timestamp = int(datetime.strptime(line[TIMESTAMP], '%Y-%m-%d %H:%M:%S').timestamp())
+			user_id = line[USER_ID]
+
+			if user_id not in user_restaurant_timestamp_rating:
+				user_restaurant_timestamp_rating[user_id] = dict()
+
+			if restaurant_id not in user_restaurant_timestamp_rating[user_id]:
+				user_restaurant_timestamp_rating[user_id][restaurant_id] = [timestamp, rating]
+			else:
+				# update the rating to latest rating
+				if timestamp > user_restaurant_timestamp_rating[user_id][restaurant_id][0]:
+					user_restaurant_timestamp_rating[user_id][restaurant_id] = [timestamp, rating]
+
+	return user_restaurant_timestamp_rating
+
+def init_review_shard_worker(restaurant_ids):
+	"""
+	initialize review shard worker process with business_ids of restaurants
+	"""
+	global _shard_restaurant_ids
+	_shard_restaurant_ids = restaurant_ids
+
+def parse_review_shard_worker(shard):
+	"""
+	shard: (review_file, start, end)
+
+	parse_review_shard in worker process
+	"""
+	(review_file, start, end) = shard
+	return parse_review_shard(review_file, start, end, _shard_restaurant_ids)
+
+def merge_review_shards(
+	shards,
+	user_id_to_int=None
+	):
+	"""
+	shards: list of results of parse_review_shard, in order of byte ranges
+	user_id_to_int: existing mapping to extend, new int_user_ids continue from its max
+
+	merge shards as if reviews are read from the start of file to the end
+
+	return:
+		user_id_to_int: mapping from user_id to int_user_id
+		user_restaurant_timestamp_rating: mapping from int_user_id to mapping from business_id to latest [timestamp, rating]
+	"""
+	user_id_to_int = dict() if user_id_to_int is None else dict(user_id_to_int)
+	user_restaurant_timestamp_rating = dict()
+	count_user_id = max(user_id_to_int.values(), default=0)
+
+	for shard in shards:
+		for (user_id, rest_rating) in shard.items():
+			# get the int type user_id
+			if user_id in user_id_to_int:
+				user_id = user_id_to_int[user_id]
+			else:
+				count_user_id += 1
+				user_id_to_int[user_id] = count_user_id
+				user_id = count_user_id
+
+			if user_id not in user_restaurant_timestamp_rating:
+				user_restaurant_timestamp_rating[user_id] = dict()
+
+			user_rest_rating = user_restaurant_timestamp_rating[user_id]
+			for (restaurant_id, latest_rating) in rest_rating.items():
+				# keep the earliest shard on same timestamp, as reading line by line does
+				if restaurant_id not in user_rest_rating \
+					or latest_rating[0] > user_rest_rating[restaurant_id][0]:
+					user_rest_rating[restaurant_id] = latest_rating
+
+	return user_id_to_int, user_restaurant_timestamp_rating
+
 def load_reviews_and_users(
 	review_file,
-	restaurants_id_to_int
+	restaurants_id_to_int,
+	num_workers=1,
+	num_shards=None,
+	user_id_to_int=None
 	):
 	"""
 	review_file: path to access review.json
 	restaurants_id_to_int: mapping from business_id to feature_id
+	num_workers: number of processes to parse review_file, 1 to parse in this process
+	num_shards: number of byte range shards to split review_file into
+		default to 4 shards per worker
+	user_id_to_int: existing mapping from user_id to int_user_id to extend
 
 	return:
 		user_id_to_int: mapping from user_id to int_user_id
 		filtered_reviews: list of reviews [int_user_id, feature_id, rating, timestamp]
 		original_reviews: list of reviews using original restaurant id [user_id, restaurant_id, rating, timestamp]
-	"""
-	user_id_to_int = dict()
 
-	# remember all latest rating on user - restaurant pair
-	user_restaurant_timestamp_rating = dict()
-
-	count_user_id = 0
+		output is same for any num_workers and num_shards
+	"""
+	shards = list()
 
 	try:
-		with open(review_file, "r") as file:
-			lines = file.readlines()
-			for line in lines:
-				line = json.loads(line)
-
-				restaurant_id = line[RESTAURANT_ID]
-				if restaurant_id not in restaurants_id_to_int:
-					continue
-
-				rating = line[RATING]
-				timestamp = int(datetime.strptime(line[TIMESTAMP], '%Y-%m-%d %H:%M:%S').timestamp())
-
-				# get the int type user_id
-				user_id = line[USER_ID]
-				if user_id in user_id_to_int:
-					user_id = user_id_to_int[user_id]
-				else:
-					count_user_id += 1
-					user_id_to_int[user_id] = count_user_id
-					user_id = count_user_id
-
-				if user_id not in user_restaurant_timestamp_rating:
-					user_restaurant_timestamp_rating[user_id] = dict()
-
-				if restaurant_id not in user_restaurant_timestamp_rating[user_id]:
-					user_restaurant_timestamp_rating[user_id][restaurant_id] = [timestamp, rating]
-				else:
-					# update the rating to latest rating
-					if timestamp > user_restaurant_timestamp_rating[user_id][restaurant_id][0]:
-						user_restaurant_timestamp_rating[user_id][restaurant_id] = [timestamp, rating]
+		if num_workers <= 1:
+			shards.append(parse_review_shard(
+				review_file,
+				0,
+				os.path.getsize(review_file),
+				restaurants_id_to_int
+				))
+		else:
+			if num_shards is None:
+				num_shards = num_workers * 4
+
+			offsets = find_shard_offsets(review_file, num_shards)
+			print("Parse {} shards of {} with {} workers".format(len(offsets), review_file, num_workers))
+
+			with multiprocessing.Pool(
+				processes=num_workers,
+				initializer=init_review_shard_worker,
+				initargs=(set(restaurants_id_to_int),)
+				) as pool:
+				shards = pool.map(
+					parse_review_shard_worker,
+					[(review_file, start, end) for (start, end) in offsets]
+					)
 
 	except IOError:
 		print("{} doesn't exists".format(review_file))
 
+	user_id_to_int, user_restaurant_timestamp_rating = merge_review_shards(
+		shards,
+		user_id_to_int=user_id_to_int
+		)
+	count_user_id = len(user_id_to_int)
+
 	filtered_reviews = list()
 	original_reviews = list()
 	for (user, rest_rating) in user_restaurant_timestamp_rating.items():
@@ -516,6 +719,79 @@ def load_reviews_and_users(
 	print("Up-to-date reviews on restaurants: {}".format(len(filtered_reviews)))
 	return user_id_to_int, filtered_reviews, original_reviews
 
+def find_review_lines(
+	review_file,
+	user_restaurants,
+	eval_set={0,1,2,3},
+	col_separator=COL_SEPARATOR
+	):
+	"""
+	review_file: path to reviews file [int_user_id, restaurant, rating, timestamp]
+	user_restaurants: mapping from int_user_id to set of restaurants to look for
+	eval_set: for each review, indices to calculate
+	col_separator: separator between key and values
+
+	return:
+		mapping from (int_user_id, restaurant) to list of [line number, rating, timestamp]
+		in order of lines
+	"""
+	found = dict()
+	if len(user_restaurants) == 0:
+		return found
+
+	users = np.fromiter(user_restaurants.keys(), dtype=np.int64, count=len(user_restaurants))
+
+	# keep ratings in float64, so values are same as written in text
+	dtypes = dict(REVIEW_DTYPES)
+	dtypes[COL_RATING] = "float64"
+
+	line = 0
+	for chunk in iter_reviews(
+		review_file,
+		eval_set=eval_set,
+		dtypes=dtypes,
+		col_separator=col_separator
+		):
+		for i in np.flatnonzero(np.isin(chunk[COL_USER], users)).tolist():
+			user = chunk[COL_USER][i].item()
+			restaurant = chunk[COL_ITEM][i]
+			if isinstance(restaurant, np.generic):
+				restaurant = restaurant.item()
+
+			if restaurant in user_restaurants[user]:
+				if (user, restaurant) not in found:
+					found[(user, restaurant)] = list()
+				found[(user, restaurant)].append([
+					line + i,
+					chunk[COL_RATING][i].item(),
+					chunk[COL_TIMESTAMP][i].item()
+					])
+
+		line += len(chunk[COL_USER])
+
+	return found
+
+def patch_lines(
+	filename,
+	replacements
+	):
+	"""
+	filename: path to text file to patch in place
+	replacements: mapping from line number to new line, None to delete the line
+	"""
+	if len(replacements) == 0:
+		return
+
+	tmp_filename = filename + ".tmp"
+	with open(filename, "r") as src, open(tmp_filename, "w") as dst:
+		for (i, line) in enumerate(src):
+			if i not in replacements:
+				dst.write(line)
+			elif replacements[i] is not None:
+				dst.write(replacements[i])
+
+	os.replace(tmp_filename, filename)
+
 def evaluate_feature_ids(
 	filtered_reviews,
 	original_reviews,
@@ -730,19 +1006,21 @@ def map_users_to_cities(
 def save_filtered_open_restaurants(
 	restaurants,
 	output_dir,
-	output_file="filtered_open_retaurants.json"
+	output_file="filtered_open_retaurants.json",
+	append=False
 	):
 	"""
 	restaurants: list of json objects for each restaurants
 	output_dir: output directory
 	output_file: output file name
+	append: whether or not to append to existing output file
 
 	output:
 	e.g.
 	{"business_id": "pQeaRpvuhoEqudo3uymHIQ", ...., "workdays": ["Monday", "Tuesday", "Wednesday", "Thursday", "Friday"]}
 	"""
 	filename = output_dir + output_file
-	with open(filename, "w") as file:
+	with open(filename, "a" if append else "w") as file:
 		for restaurant in restaurants:
 			file.write("{}\n".format(json.dumps(restaurant)))
 
@@ -779,19 +1057,48 @@ def save_features(
 def save_feature_vec_to_int(
 	feature_vector_to_int,
 	output_dir,
-	output_file="feature_vector_to_int.json"
+	output_file="feature_vector_to_int.json",
+	append=False,
+	codec=None,
+	packed=False
 	):
 	"""
 	feature_vector_to_int: mapping from feature_dict to feature_id
 	output_dir: output directory
 	output_file: output file name
+	append: whether or not to append to existing output file
+	codec: FeatureCodec if keys of feature_vector_to_int are packed bytes
+	packed: whether or not to save packed form, needs codec
 
 	output:
 		each line is json object contains feature_id and feature_dict
+
+		if packed, columnar directory instead
+		packed.npy: packed feature vector per row, feature_id.npy: feature_id per row
+		header.json: codec to decode packed feature vectors
 	"""
+	if packed:
+		if codec is None:
+			raise ValueError("codec is needed to save packed feature vectors")
+
+		packed_rows = np.frombuffer(b"".join(feature_vector_to_int.keys()), dtype=np.uint8)
+		save_columnar(
+			columns={
+				"packed" : packed_rows.reshape(len(feature_vector_to_int), codec.row_bytes),
+				FEATURE_ID : np.fromiter(feature_vector_to_int.values(), dtype=np.int32, count=len(feature_vector_to_int))
+			},
+			output_dir=output_dir,
+			output_file=output_file,
+			header={"codec" : codec.to_header()}
+			)
+		return
+
 	filename = output_dir + output_file
-	with open(filename, "w") as file:
+	with open(filename, "a" if append else "w") as file:
 		for (feature_dict, feature_id) in feature_vector_to_int.items():
+			if codec is not None:
+				feature_dict = codec.decode(feature_dict)
+
 			item = dict()
 			item[FEATURE_ID] = feature_id
 			item[FEATURE_DICT] = dict(feature_dict)
@@ -803,7 +1110,8 @@ def save_mapping(
 	value_is_set,
 	output_dir,
 	output_file,
-	col_separator=COL_SEPARATOR
+	col_separator=COL_SEPARATOR,
+	append=False
 	):
 	"""
 	mapping: one-on-one mapping in dictionary
@@ -811,58 +1119,143 @@ def save_mapping(
 	output_dir: output directory
 	output_file: output file name
 	col_separator: separator between key and values
+	append: whether or not to append to existing output file
 
 	output:
 		each line is (key, value) pair separated by col_separator
 		if value_is_set, then create pairs for each val in value set
 	"""
 	filename = output_dir + output_file
+	mode = "a" if append else "w"
 	if value_is_set:
-		with open(filename, "w") as file:
+		with open(filename, mode) as file:
 			for (key, vals) in mapping.items():
 				for val in vals:
 					file.write("{}{}{}\n".format(key, col_separator, val))
 	else:
-		with open(filename, "w") as file:
+		with open(filename, mode) as file:
 			for (key, val) in mapping.items():
 				file.write("{}{}{}\n".format(key, col_separator, val))
 
 
+def save_columnar(
+	columns,
+	output_dir,
+	output_file,
+	header=None
+	):
+	"""
+	columns: mapping from column name to numpy array, all arrays have same length
+	output_dir: output directory
+	output_file: output directory name of the columnar store
+	header: extra json serializable information to keep in header
+
+	output:
+		header.json: version, number of rows, (column name, dtype) of each column
+		<column name>.npy: one array per column, can be memory-mapped on load
+	"""
+	filedir = output_dir + output_file
+	os.makedirs(os.path.dirname(filedir), exist_ok=True)
+
+	rows = None
+	for (name, array) in columns.items():
+		if rows is None:
+			rows = len(array)
+		elif len(array) != rows:
+			raise ValueError("column {} has {} rows, expect {}".format(name, len(array), rows))
+
+	for (name, array) in columns.items():
+		np.save(filedir + name + ".npy", np.ascontiguousarray(array))
+
+	item = dict()
+	if header is not None:
+		item.update(header)
+	item["version"] = COLUMNAR_VERSION
+	item["rows"] = 0 if rows is None else rows
+	item["columns"] = [[name, str(array.dtype)] for (name, array) in columns.items()]
+
+	# header is written last, so a half written store can't be loaded
+	with open(filedir + COLUMNAR_HEADER, "w") as file:
+		file.write(json.dumps(item))
+
+def format_review(
+	review,
+	col_separator=COL_SEPARATOR
+	):
+	"""
+	review: [int_user_id, feature_id, rating, timestamp]
+	col_separator: separator between key and values
+
+	return line of review in review file
+	"""
+	return "{}{}{}{}{}{}{}\n".format(
+		review[0], col_separator,
+		review[1], col_separator,
+		review[2], col_separator,
+		review[3])
+
 def save_reviews(
 	reviews,
 	output_dir,
 	output_file,
-	col_separator=COL_SEPARATOR
+	col_separator=COL_SEPARATOR,
+	save_columnar_reviews=False,
+	append=False
 	):
 	"""
 	reviews: list of reviews [int_user_id, feature_id, rating, timestamp]
 	output_dir: output directory
 	output_file: output file name
 	col_separator: separator between key and values
+	save_columnar_reviews: whether or not to also save reviews in columnar format
+	append: whether or not to append to existing output file
+		columnar format always holds only reviews given here
 
 	output:
 		each line is col_separator separated review [int_user_id, feature_id, rating, timestamp]
+
+		if save_columnar_reviews, also <output_file without extension>.columnar/
+		int_user_id (int32), feature_id (int32), rating (float32), timestamp (int64)
 	"""
 	filename = output_dir + output_file
-	with open(filename, "w") as file:
+	with open(filename, "a" if append else "w") as file:
 		for review in reviews:
-			file.write("{}{}{}{}{}{}{}\n".format(
-				review[0], col_separator,
-				review[1], col_separator,
-				review[2], col_separator,
-				review[3]))
+			file.write(format_review(review, col_separator))
+
+	if save_columnar_reviews:
+		columns = dict()
+		for i in range(len(REVIEW_COLUMNS)):
+			columns[REVIEW_COLUMNS[i]] = np.fromiter(
+				(review[i] for review in reviews),
+				dtype=REVIEW_DTYPES[REVIEW_COLUMNS[i]],
+				count=len(reviews)
+				)
+
+		save_columnar(
+			columns=columns,
+			output_dir=output_dir,
+			output_file=os.path.splitext(output_file)[0] + COLUMNAR_EXT
+			)
 
 def preprocess_yelp_open_dataset(
 	business_file,
 	review_file,
 	output_dir,
 	feature_separator=FEATURE_SEPARATOR,
-	col_separator=COL_SEPARATOR
+	col_separator=COL_SEPARATOR,
+	num_workers=1,
+	streaming=False,
+	pack_feature_vectors=False
 	):
 	"""
 	business_file: path to access business.json 
 	review_file: path to access review.json
 	output_dir: path to save output files
+	num_workers: number of processes to parse review_file
+	streaming: whether or not to read business_file in 2 passes without keeping restaurants
+		first pass collects features, second pass develops feature ids
+	pack_feature_vectors: whether or not to develop feature ids on packed feature vectors
+		and also save feature_vector_to_int.columnar/
 
 	output files:
 
@@ -900,16 +1293,32 @@ def preprocess_yelp_open_dataset(
 	e.g.
 	vjTVxnsQEZ34XjYNS-XUpA	4
 
+	feature_id_to_restaurants_id.data:
+	map int feature_id back to business_ids, in order of restaurants_id_to_int.data
+	e.g.
+	4	vjTVxnsQEZ34XjYNS-XUpA
+
 	feature_vector_to_int.json:
 	map restaurant feature vector to feature_id
 	each line is json object contains feature_id and feature_dict
 
+	feature_vector_to_int.columnar/:
+	only if pack_feature_vectors, packed feature vectors and their feature_id
+	header.json keeps the codec to decode them
+
 	filtered_reviews.data:
 	each line is a rating behavior:
 	int_user_id, feature_id, rating, timestamp
 	e.g.
 	1	93	5.0	1575497346
 
+	dedup_filtered_reviews.data:
+	same format as filtered_reviews.data, one rating per user-feature pair
+
+	dedup_filtered_reviews.columnar/:
+	dedup_filtered_reviews.data as memory-mappable columns
+	header.json, int_user_id.npy, feature_id.npy, rating.npy, timestamp.npy
+
 	int_user_id_to_cities.data:
 	this file is for inferring users' location from reviews
 	e.g.
@@ -926,19 +1335,38 @@ def preprocess_yelp_open_dataset(
 
 	# load from original dataset
 	restaurants, tffeature, valfeature, existfeature = load_restaurants_and_features(
-		business_file=business_file
+		business_file=business_file,
+		keep_restaurants=not streaming
 		)
 
+	if streaming:
+		# second pass over business_file, restaurants are saved on the fly
+		restaurant_locations = list()
+		restaurants = iter_restaurants_with_locations(
+			business_file=business_file,
+			restaurant_locations=restaurant_locations,
+			output_file=output_dir + "filtered_open_retaurants.json"
+			)
+
+	codec = None
+	if pack_feature_vectors:
+		codec = FeatureCodec(tffeature, valfeature, existfeature)
+
 	feature_vector_to_int, restaurants_id_to_int = develop_feature_ids(
 		restaurants=restaurants, 
 		tffeature=tffeature, 
 		valfeature=valfeature, 
-		existfeature=existfeature
+		existfeature=existfeature,
+		codec=codec
 		)
 
+	if streaming:
+		restaurants = restaurant_locations
+
 	user_id_to_int, filtered_reviews, original_reviews = load_reviews_and_users(
 		review_file=review_file, 
-		restaurants_id_to_int=restaurants_id_to_int
+		restaurants_id_to_int=restaurants_id_to_int,
+		num_workers=num_workers
 		)
 
 	# study features
@@ -967,11 +1395,12 @@ def preprocess_yelp_open_dataset(
 		)
 
 	# save data
-	save_filtered_open_restaurants(
-		restaurants=restaurants,
-		output_dir=output_dir,
-		output_file="filtered_open_retaurants.json"
-		)
+	if not streaming:
+		save_filtered_open_restaurants(
+			restaurants=restaurants,
+			output_dir=output_dir,
+			output_file="filtered_open_retaurants.json"
+			)
 
 	save_features(
 		features=tffeature,
@@ -997,9 +1426,19 @@ def preprocess_yelp_open_dataset(
 	save_feature_vec_to_int(
 		feature_vector_to_int=feature_vector_to_int,
 		output_dir=output_dir,
-		output_file="feature_vector_to_int.json"
+		output_file="feature_vector_to_int.json",
+		codec=codec
 		)
 
+	if pack_feature_vectors:
+		save_feature_vec_to_int(
+			feature_vector_to_int=feature_vector_to_int,
+			output_dir=output_dir,
+			output_file="feature_vector_to_int" + COLUMNAR_EXT,
+			codec=codec,
+			packed=True
+			)
+
 	save_mapping(
 		mapping=restaurants_id_to_int, 
 		value_is_set=False, 
@@ -1007,6 +1446,13 @@ def preprocess_yelp_open_dataset(
 		output_file="restaurants_id_to_int.data"
 		)
 
+	save_mapping(
+		mapping=invert_mapping(restaurants_id_to_int),
+		value_is_set=True,
+		output_dir=output_dir,
+		output_file="feature_id_to_restaurants_id.data"
+		)
+
 	save_mapping(
 		mapping=user_id_to_int, 
 		value_is_set=False, 
@@ -1023,7 +1469,8 @@ def preprocess_yelp_open_dataset(
 	save_reviews(
 		reviews=dedup_filtered_reviews,
 		output_dir=output_dir,
-		output_file="dedup_filtered_reviews.data"
+		output_file="dedup_filtered_reviews.data",
+		save_columnar_reviews=True
 		)
 
 	save_reviews(
@@ -1045,3 +1492,288 @@ def preprocess_yelp_open_dataset(
 		output_dir=output_dir, 
 		output_file="int_user_id_to_cities.data"
 		)
+
+
+def preprocess_yelp_open_dataset_incremental(
+	business_file,
+	review_file,
+	output_dir,
+	dedup_by="average",
+	col_separator=COL_SEPARATOR,
+	num_workers=1
+	):
+	"""
+	business_file: path to business.json with only new businesses
+	review_file: path to review.json with only new reviews
+	output_dir: path of output files from preprocess_yelp_open_dataset, patched in place
+	dedup_by: deduplication used for dedup_filtered_reviews.data, "latest" or "average"
+	num_workers: number of processes to parse review_file
+
+	new ids continue from max of user_id_to_int, restaurants_id_to_int and feature_vector_to_int
+	only user-feature pairs rated in review_file are deduplicated again
+	rows of new pairs are appended, so row order can differ from a full preprocess
+
+	limitations:
+		feature vocabulary (tffeature / valfeature / existfeature) is kept as is,
+		new categories or attributes only take effect after a full preprocess_yelp_open_dataset
+		businesses already in restaurants_id_to_int keep their feature_id
+	"""
+	# load existing output
+	tffeature = load_features(output_dir + "tffeature.data")
+	existfeature = load_features(output_dir + "existfeature.data")
+	valfeature = load_features(output_dir + "valfeature.data", load_mapping=True)
+
+	# packed feature vectors are kept packed if they were saved
+	packed_dir = output_dir + "feature_vector_to_int" + COLUMNAR_EXT
+	if os.path.isdir(packed_dir):
+		feature_vector_to_int, codec = load_packed_feature_vec_to_int(packed_dir)
+	else:
+		feature_vector_to_int = load_feature_vec_to_int(output_dir + "feature_vector_to_int.json")
+		codec = None
+	restaurants_id_to_int = load_mapping(
+		input_file=output_dir + "restaurants_id_to_int.data",
+		value_is_set=False,
+		eval_set={1}
+		)
+	user_id_to_int = load_mapping(
+		input_file=output_dir + "user_id_to_int.data",
+		value_is_set=False,
+		eval_set={1}
+		)
+	feature_id_to_cities = load_mapping(
+		input_file=output_dir + "feature_id_to_cities.data",
+		value_is_set=False,
+		eval_set={0}
+		)
+	int_user_id_to_cities = load_mapping(
+		input_file=output_dir + "int_user_id_to_cities.data",
+		value_is_set=True,
+		eval_set={0}
+		)
+
+	# new restaurants
+	new_restaurants = [restaurant for restaurant in iter_open_restaurants(business_file) 
+						if restaurant[RESTAURANT_ID] not in restaurants_id_to_int]
+	print("New restaurants: {}".format(len(new_restaurants)))
+
+	max_feature_id = max(feature_vector_to_int.values(), default=0)
+	feature_vector_to_int, restaurants_id_to_int = develop_feature_ids(
+		restaurants=new_restaurants,
+		tffeature=tffeature,
+		valfeature=valfeature,
+		existfeature=existfeature,
+		feature_vector_to_int=feature_vector_to_int,
+		restaurants_id_to_int=restaurants_id_to_int,
+		codec=codec
+		)
+
+	new_feature_vector_to_int = dict()
+	for (feature_dict, feature_id) in feature_vector_to_int.items():
+		if feature_id > max_feature_id:
+			new_feature_vector_to_int[feature_dict] = feature_id
+
+	new_restaurants_id_to_int = dict()
+	for restaurant in new_restaurants:
+		new_restaurants_id_to_int[restaurant[RESTAURANT_ID]] = restaurants_id_to_int[restaurant[RESTAURANT_ID]]
+
+	new_feature_id_to_cities = dict()
+	for (feature_id, city) in map_restaurants_to_cities(new_restaurants, restaurants_id_to_int).items():
+		if feature_id not in feature_id_to_cities:
+			new_feature_id_to_cities[feature_id] = city
+	feature_id_to_cities.update(new_feature_id_to_cities)
+
+	# new reviews
+	count_user_id = len(user_id_to_int)
+	user_id_to_int, filtered_reviews, original_reviews = load_reviews_and_users(
+		review_file=review_file,
+		restaurants_id_to_int=restaurants_id_to_int,
+		num_workers=num_workers,
+		user_id_to_int=user_id_to_int
+		)
+
+	new_user_id_to_int = dict()
+	for (user_id, int_user_id) in list(user_id_to_int.items())[count_user_id:]:
+		new_user_id_to_int[user_id] = int_user_id
+
+	# patch latest rating of user - restaurant pairs
+	user_restaurants = dict()
+	for review in original_reviews:
+		if review[0] not in user_restaurants:
+			user_restaurants[review[0]] = set()
+		user_restaurants[review[0]].add(review[1])
+
+	existing_reviews = find_review_lines(
+		review_file=output_dir + "original_reviews.data",
+		user_restaurants=user_restaurants,
+		eval_set={0,2,3},
+		col_separator=col_separator
+		)
+
+	original_replacements = dict()
+	filtered_replacements = dict()
+	appended_original_reviews = list()
+	appended_filtered_reviews = list()
+	user_features = dict()
+
+	for i in range(len(original_reviews)):
+		[user, restaurant, rating, timestamp] = original_reviews[i]
+		existing = existing_reviews.get((user, restaurant))
+
+		if existing is None:
+			appended_original_reviews.append(original_reviews[i])
+			appended_filtered_reviews.append(filtered_reviews[i])
+		elif timestamp > existing[0][2]:
+			# update the rating to latest rating
+			line = existing[0][0]
+			original_replacements[line] = format_review(original_reviews[i], col_separator)
+			filtered_replacements[line] = format_review(filtered_reviews[i], col_separator)
+		else:
+			continue
+
+		feature_id = filtered_reviews[i][1]
+		if user not in user_features:
+			user_features[user] = set()
+		user_features[user].add(feature_id)
+
+	patch_lines(output_dir + "original_reviews.data", original_replacements)
+	patch_lines(output_dir + "filtered_reviews.data", filtered_replacements)
+
+	save_reviews(
+		reviews=appended_original_reviews,
+		output_dir=output_dir,
+		output_file="original_reviews.data",
+		col_separator=col_separator,
+		append=True
+		)
+
+	save_reviews(
+		reviews=appended_filtered_reviews,
+		output_dir=output_dir,
+		output_file="filtered_reviews.data",
+		col_separator=col_separator,
+		append=True
+		)
+
+	print("New reviews on restaurants: {}".format(len(appended_filtered_reviews)))
+	print("Updated reviews on restaurants: {}".format(len(filtered_replacements)))
+
+	# dedup again affected user - feature pairs
+	affected_reviews = list()
+	for ((user, feature_id), rows) in find_review_lines(
+		review_file=output_dir + "filtered_reviews.data",
+		user_restaurants=user_features,
+		col_separator=col_separator
+		).items():
+		for [line, rating, timestamp] in rows:
+			affected_reviews.append([user, feature_id, rating, timestamp])
+
+	dedup_filtered_reviews = load_dedup_filtered_reviews(
+		filtered_reviews=affected_reviews,
+		dedup_by=dedup_by
+		)
+
+	dedup_replacements = dict()
+	for rows in find_review_lines(
+		review_file=output_dir + "dedup_filtered_reviews.data",
+		user_restaurants=user_features,
+		col_separator=col_separator
+		).values():
+		for [line, rating, timestamp] in rows:
+			dedup_replacements[line] = None
+
+	patch_lines(output_dir + "dedup_filtered_reviews.data", dedup_replacements)
+	save_reviews(
+		reviews=dedup_filtered_reviews,
+		output_dir=output_dir,
+		output_file="dedup_filtered_reviews.data",
+		col_separator=col_separator,
+		append=True
+		)
+
+	columnar_dir = output_dir + "dedup_filtered_reviews" + COLUMNAR_EXT
+	if os.path.isdir(columnar_dir):
+		save_columnar(
+			columns=load_review_columns(
+				output_dir + "dedup_filtered_reviews.data",
+				col_separator=col_separator
+				),
+			output_dir=output_dir,
+			output_file="dedup_filtered_reviews" + COLUMNAR_EXT
+			)
+
+	# new cities of users
+	new_int_user_id_to_cities = dict()
+	for review in dedup_filtered_reviews:
+		user = review[0]
+		city = feature_id_to_cities[review[1]]
+		if city in int_user_id_to_cities.get(user, []):
+			continue
+
+		if user not in new_int_user_id_to_cities:
+			new_int_user_id_to_cities[user] = set()
+		new_int_user_id_to_cities[user].add(city)
+
+	# save data
+	save_filtered_open_restaurants(
+		restaurants=new_restaurants,
+		output_dir=output_dir,
+		output_file="filtered_open_retaurants.json",
+		append=True
+		)
+
+	save_feature_vec_to_int(
+		feature_vector_to_int=new_feature_vector_to_int,
+		output_dir=output_dir,
+		output_file="feature_vector_to_int.json",
+		append=True,
+		codec=codec
+		)
+
+	if codec is not None:
+		save_feature_vec_to_int(
+			feature_vector_to_int=feature_vector_to_int,
+			output_dir=output_dir,
+			output_file="feature_vector_to_int" + COLUMNAR_EXT,
+			codec=codec,
+			packed=True
+			)
+
+	save_mapping(
+		mapping=new_restaurants_id_to_int, 
+		value_is_set=False, 
+		output_dir=output_dir, 
+		output_file="restaurants_id_to_int.data",
+		append=True
+		)
+
+	save_mapping(
+		mapping=invert_mapping(new_restaurants_id_to_int),
+		value_is_set=True,
+		output_dir=output_dir,
+		output_file="feature_id_to_restaurants_id.data",
+		append=True
+		)
+
+	save_mapping(
+		mapping=new_user_id_to_int, 
+		value_is_set=False, 
+		output_dir=output_dir, 
+		output_file="user_id_to_int.data",
+		append=True
+		)
+
+	save_mapping(
+		mapping=new_feature_id_to_cities, 
+		value_is_set=False, 
+		output_dir=output_dir, 
+		output_file="feature_id_to_cities.data",
+		append=True
+		)
+
+	save_mapping(
+		mapping=new_int_user_id_to_cities, 
+		value_is_set=True, 
+		output_dir=output_dir, 
+		output_file="int_user_id_to_cities.data",
+		append=True
+		)
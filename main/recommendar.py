@@ -1,15 +1,24 @@
 import os
+import threading
 import pandas as pd
 import numpy as np
 from datetime import datetime
+from functools import partial
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
 
 from main.constants import *
 from main.data_loader import *
 from main.evaluation import *
+from main.review_index import UserReviewIndex, CityReviewIndex, CityReviewCursor
+from main.recommendation_cache import RecommendationCache
+from main.shared_dataset import publish_arrays, attach_arrays, release_arrays
 from main.model.baseline_model import Model as BaselineModel
 from main.model.als_model import Model as AlsModel
+from main.model.numpy_als_model import Model as NumpyAlsModel
 from main.model.naive_hybrid_baseline_als_model import Model as NHBAModel
+from main.model.naive_hybrid_baseline_als_model import NumpyModel as NumpyNHBAModel
 from main.model.time_biased_hybrid_model import Model as TBHModel
+from main.model.time_biased_hybrid_model import NumpyModel as NumpyTBHModel
 
 #-------------------------------
 # Constants
@@ -18,9 +27,15 @@ MAPPING_MODEL = {
 	"baseline" : BaselineModel,
 	"als" : AlsModel,
 	"nhba" : NHBAModel,
-	"tbh" : TBHModel
+	"tbh" : TBHModel,
+	"numpy_als" : NumpyAlsModel,
+	"numpy_nhba" : NumpyNHBAModel,
+	"numpy_tbh" : NumpyTBHModel
 }
 
+# recommendar of worker process, see train_for_all_user
+_worker_recommendar = None
+
 #-------------------------------
 # Helper Functions
 #-------------------------------
@@ -28,7 +43,19 @@ def map_user_to_ratings(reviews):
 	"""
 	helper function
 	return mapping from user_id to num of ratings in reviews
+
+	reviews can be list of reviews or pandas dataframe of reviews
 	"""
+	if isinstance(reviews, pd.DataFrame):
+		# same counting and same order of users as the loop below
+		users, first_index, counts = np.unique(
+			reviews[COL_USER].to_numpy(),
+			return_index=True,
+			return_counts=True
+			)
+		order = np.argsort(first_index)
+		return dict(zip(users[order].tolist(), (counts[order] - 1).tolist()))
+
 	user_ratings = dict()
 	for review in reviews:
 		user = review[0]
@@ -39,26 +66,52 @@ def map_user_to_ratings(reviews):
 
 	return user_ratings
 
-def map_feature_ids_to_restaurants(feature_list, rest_id_to_int):
+def _init_worker(config):
 	"""
 	helper function
-	return list of restaurants mapped from feature in feature_list
-	in same order as feature_list
+	initializer of worker process, load recommendar once per process
+
+	config: keyword arguments of LocalRecommendar.from_shared_dataset
+	"""
+	global _worker_recommendar
+	_worker_recommendar = LocalRecommendar.from_shared_dataset(**config)
+
+def _personalized_train_job(user_id, train_number, warm_start):
+	"""
+	helper function
+	personalized_train of one user in worker process
+
+	return lists of precision @ k, recall @ k, average precision @ k
 	"""
+	return _worker_recommendar.personalized_train(
+		user_id=user_id,
+		train_number=train_number,
+		warm_start=warm_start
+		)
 
-	invert_mapping = dict()
-	for (rest_id, feature) in rest_id_to_int.items():
-		if feature not in feature_list:
-			continue
+def _record_job(checkpoint, model, user_id, train_number, future):
+	"""
+	helper function
+	record results of finished _personalized_train_job to checkpoint
+	"""
+	if not future.cancelled() and future.exception() is None:
+		checkpoint.record(model, user_id, train_number, *future.result())
 
-		if feature not in invert_mapping:
-			invert_mapping[feature] = list()
+def map_feature_ids_to_restaurants(feature_list, rest_id_to_int=None, feature_id_to_rest_ids=None):
+	"""
+	helper function
+	return list of restaurants mapped from feature in feature_list
+	in same order as feature_list
 
-		invert_mapping[feature].append(rest_id)
+	feature_id_to_rest_ids: precomputed invert_mapping(rest_id_to_int)
+		built from rest_id_to_int if not given
+	"""
+	if feature_id_to_rest_ids is None:
+		feature_id_to_rest_ids = invert_mapping(rest_id_to_int)
 
 	rest_list = list()
 	for feature in feature_list:
-		rest_list += invert_mapping[feature]
+		rest_list += feature_id_to_rest_ids.get(feature, [])
 
 	return rest_list
 
@@ -74,14 +127,17 @@ def get_recommendar(
 	k=TOP_K,
 	removeSeen=True,
 	infer_loc_by_latest_rating_only=True,
-	latest_rating_limiter=3
+	latest_rating_limiter=3,
+	shared_models=False,
+	cache=None
 	):
 	"""
 	factory method to get a recommendar instance
 
 		reviews:
 			list of reviews to consider, should contain all reviews updated
-			filename to load reviews data
+			pandas dataframe of reviews, e.g. loaded from columnar reviews
+			filename to load reviews data, or directory of columnar reviews
 
 		user_city:
 			mapping from int_user_id to city
@@ -94,6 +150,7 @@ def get_recommendar(
 		rest_id_to_int:
 			mapping from restaurants id to feature id
 			filename to load restaurants id to feature id
+				feature_id_to_restaurants_id.data next to it is loaded as its inverse if exists
 
 		model:
 			model for train
@@ -112,6 +169,15 @@ def get_recommendar(
 		latest_rating_limiter:
 			hyperparameters for whole recommendar
 			number of latest rating to consider for each user
+
+		shared_models:
+			true, predict scores users on one model per inferred city set
+			false, predict trains a model for each request
+			models windowed by user, e.g. tbh, are always trained for each request
+
+		cache:
+			RecommendationCache to keep recommendations until user or city gets new reviews
+			None, recommendations are not cached
 	"""
 	return LocalRecommendar(
 		reviews=reviews,
@@ -122,23 +188,33 @@ def get_recommendar(
 		k=k,
 		removeSeen=removeSeen,
 		infer_loc_by_latest_rating_only=infer_loc_by_latest_rating_only,
-		latest_rating_limiter=latest_rating_limiter
+		latest_rating_limiter=latest_rating_limiter,
+		shared_models=shared_models,
+		cache=cache
 		)
 
 class LocalRecommendar:
 	"""
 	state:
-		self.reviews : list of reviews from review_file
+		self.reviews : list of reviews, only built from self.reviews_dataframe when asked
 		self.user_city : int_user_id maps to cities
 		self.rest_city : feature_id maps to cities
 		self.rest_id_to_int : restaurant_id maps to feature_id
+		self.feature_id_to_rest_ids : feature_id maps to restaurant_ids, in order of rest_id_to_int
 		self.model : model to do recommendation
 		self.k : top k restaurants' feature id to recommend
 		self.removeSeen : whether or not recommend seen feature_id
-		self.reviews_dataframe : pandas dataframe of reviews
-		self.user_ratings : mapping from user id to num of ratings
+		self.reviews_dataframe : pandas dataframe of reviews, typed by REVIEW_DTYPES
+		self.user_ratings : mapping from user id to num of ratings, only built when asked
+		self.user_index : reviews_dataframe grouped by user and sorted by timestamp
+		self.city_index : feature_ids and reviews_dataframe partitioned by city
 		self.infer_loc_by_latest_rating_only : whether or not consider latest rating
 		self.latest_rating_limiter : num of latest rating to consider
+		self.shared_models : whether or not predict uses models shared by city set
+		self.city_models : frozenset of cities maps to trained shared model
+		self.cache : RecommendationCache of predict, None if not cached
+		self.city_review_counts : city maps to num of reviews, part of data version of cache
+		self.shared_dataset : handles of dataset published to shared memory, None if not published
 	"""
 	def __init__(
 		self,
@@ -150,14 +226,18 @@ class LocalRecommendar:
 		k=TOP_K,
 		removeSeen=True,
 		infer_loc_by_latest_rating_only=True,
-		latest_rating_limiter=3
+		latest_rating_limiter=3,
+		shared_models=False,
+		cache=None,
+		review_indexes=None
 		):
 		"""
 		initialize all state
 
 			reviews:
 				list of reviews to consider, should contain all reviews updated
-				filename to load reviews data
+				pandas dataframe of reviews, e.g. loaded from columnar reviews
+				filename to load reviews data, or directory of columnar reviews
 
 			user_city:
 				mapping from int_user_id to city
@@ -170,6 +250,7 @@ class LocalRecommendar:
 			rest_id_to_int:
 				mapping from restaurants id to feature id
 				filename to load restaurants id to feature id
+					feature_id_to_restaurants_id.data next to it is loaded as its inverse if exists
 
 			model: 
 				string name for model
@@ -186,15 +267,31 @@ class LocalRecommendar:
 			latest_rating_limiter:
 				hyperparameters for whole recommendar
 				number of latest rating to consider for each user
+
+			shared_models:
+				true, predict scores users on one model per inferred city set
+				see build_city_models to train them up front
+				ignored by models windowed by user, e.g. tbh, they are trained per user
+
+			cache:
+				RecommendationCache to keep recommendations until user or city gets new reviews
+				None, recommendations are not cached
+
+			review_indexes:
+				(UserReviewIndex, CityReviewIndex) already built over reviews, e.g. attached from shared memory
+				None, built from reviews
 		"""
 		
-		# load reviews
-		if isinstance(reviews, list):
-			self.reviews = reviews
+		# load reviews, only typed columns are kept
+		self._reviews = None
+		if isinstance(reviews, (list, pd.DataFrame)):
+			self.reviews_dataframe = reviews_to_dataframe(reviews)
+		elif isinstance(reviews, str) and os.path.isdir(reviews):
+			self.reviews_dataframe = load_reviews(reviews, columnar=True)
 		elif isinstance(reviews, str):
-			self.reviews = load_reviews(reviews)
+			self.reviews_dataframe = reviews_to_dataframe(load_review_columns(reviews))
 		else:
-			raise ValueError(f"reviews = {reviews} has invalid type: not list nor str")
+			raise ValueError(f"reviews = {reviews} has invalid type: not list nor dataframe nor str")
 
 		# load user_city
 		if isinstance(user_city, dict):
@@ -232,6 +329,20 @@ class LocalRecommendar:
 		else:
 			raise ValueError(f"rest_id_to_int = {rest_id_to_int} has invalid type: not dict nor str")
 
+		# inverse written by preprocessor, same order as invert_mapping
+		inverse_file = None
+		if isinstance(rest_id_to_int, str):
+			inverse_file = os.path.join(os.path.dirname(rest_id_to_int), "feature_id_to_restaurants_id.data")
+
+		if inverse_file is not None and os.path.exists(inverse_file):
+			self.feature_id_to_rest_ids = load_mapping(
+				input_file=inverse_file,
+				value_is_set=True,
+				eval_set={0}
+				)
+		else:
+			self.feature_id_to_rest_ids = invert_mapping(self.rest_id_to_int)
+
 		# load model
 		if model not in MAPPING_MODEL:
 			raise ValueError(f"model {model} doesn't exist")
@@ -241,14 +352,146 @@ class LocalRecommendar:
 		self.removeSeen = removeSeen
 		self.infer_loc_by_latest_rating_only = infer_loc_by_latest_rating_only
 		self.latest_rating_limiter = latest_rating_limiter
+		self.shared_models = shared_models
+		self.city_models = dict()
+		self.city_models_lock = threading.Lock()
+		self.city_model_locks = dict()
+		self.cache = cache
+
+		self.shared_dataset = None
+
+		self._user_ratings = None
+		if review_indexes is None:
+			self.user_index = UserReviewIndex(self.reviews_dataframe)
+			self.city_index = CityReviewIndex(self.reviews_dataframe, self.rest_city)
+		else:
+			self.user_index, self.city_index = review_indexes
+		self.city_review_counts = self.city_index.counts()
 
+	@classmethod
+	def from_shared_dataset(cls, shared_dataset, **kwargs):
+		"""
+		load recommendar over dataset published by share_dataset, e.g. in worker process
+
+			shared_dataset:
+				handles returned by share_dataset
+
+			kwargs:
+				other arguments of LocalRecommendar, e.g. model, k
 
-		self.reviews_dataframe = pd.DataFrame(
-			self.reviews, 
-			columns=[COL_USER, COL_ITEM, COL_RATING, COL_TIMESTAMP]
+		review columns and indexes are read-only and not copied
+		user_city is not shared, it is not used by train nor predict
+		"""
+		arrays = attach_arrays(shared_dataset["arrays"])
+
+		reviews_dataframe = pd.DataFrame(
+			{col : arrays["reviews." + col] for col in REVIEW_COLUMNS},
+			copy=False
 			)
 
-		self.user_ratings = map_user_to_ratings(self.reviews)
+		cities = shared_dataset["cities"]
+		rest_city = dict(zip(
+			arrays["rest_city.feature_ids"].tolist(),
+			(cities[code] for code in arrays["rest_city.codes"].tolist())
+			))
+		rest_id_to_int = dict(zip(
+			(rest_id.decode() for rest_id in arrays["rest_id_to_int.rest_ids"].tolist()),
+			arrays["rest_id_to_int.feature_ids"].tolist()
+			))
+
+		user_index = UserReviewIndex.from_arrays(
+			reviews_dataframe,
+			{name : arrays["user_index." + name] for name in ["order", "users", "offsets", "timestamps"]}
+			)
+		city_index = CityReviewIndex.from_arrays(
+			reviews_dataframe,
+			rest_city,
+			{name : arrays["city_index." + name] for name in ["order", "offsets", "timestamps"]}
+			)
+
+		return cls(
+			reviews=reviews_dataframe,
+			user_city=dict(),
+			rest_city=rest_city,
+			rest_id_to_int=rest_id_to_int,
+			review_indexes=(user_index, city_index),
+			**kwargs
+			)
+
+	def share_dataset(self):
+		"""
+		publish review columns, review indexes, rest_city and rest_id_to_int to shared memory
+
+		return handles to pass to from_shared_dataset, small and picklable
+			published once, segments are released by close or when this process exits
+		"""
+		if self.shared_dataset is not None:
+			return self.shared_dataset
+
+		arrays = dict()
+		for col in REVIEW_COLUMNS:
+			arrays["reviews." + col] = self.reviews_dataframe[col].to_numpy()
+		for (name, array) in self.user_index.to_arrays().items():
+			arrays["user_index." + name] = array
+		for (name, array) in self.city_index.to_arrays().items():
+			arrays["city_index." + name] = array
+
+		city_to_code = dict()
+		for city in self.rest_city.values():
+			if city not in city_to_code:
+				city_to_code[city] = len(city_to_code)
+		arrays["rest_city.feature_ids"] = np.fromiter(self.rest_city.keys(), dtype=np.int64, count=len(self.rest_city))
+		arrays["rest_city.codes"] = np.fromiter(
+			(city_to_code[city] for city in self.rest_city.values()),
+			dtype=np.int32,
+			count=len(self.rest_city)
+			)
+
+		arrays["rest_id_to_int.rest_ids"] = np.array(
+			[rest_id.encode() for rest_id in self.rest_id_to_int.keys()],
+			dtype=bytes
+			)
+		arrays["rest_id_to_int.feature_ids"] = np.fromiter(
+			self.rest_id_to_int.values(),
+			dtype=np.int64,
+			count=len(self.rest_id_to_int)
+			)
+
+		self.shared_dataset = {
+			"arrays" : publish_arrays(arrays),
+			"cities" : list(city_to_code)
+		}
+		return self.shared_dataset
+
+	def release_shared_dataset(self):
+		"""
+		unlink shared memory published by share_dataset, recommendars attached to it keep working
+		"""
+		if self.shared_dataset is not None:
+			release_arrays(self.shared_dataset["arrays"])
+			self.shared_dataset = None
+
+	@property
+	def user_ratings(self):
+		"""
+		mapping from user id to num of ratings
+		built from self.reviews_dataframe on first access
+		"""
+		if self._user_ratings is None:
+			self._user_ratings = map_user_to_ratings(self.reviews_dataframe)
+		return self._user_ratings
+
+	@property
+	def reviews(self):
+		"""
+		list of reviews [int_user_id, feature_id, rating, timestamp]
+		built from self.reviews_dataframe on first access
+		"""
+		if self._reviews is None:
+			self._reviews = list(map(list, zip(
+				*(self.reviews_dataframe[col].tolist() for col in REVIEW_COLUMNS)
+				)))
+		return self._reviews
 
 	def train_for_all_user(
 		self,
@@ -256,7 +499,10 @@ class LocalRecommendar:
 		user_list,
 		train_number_params,
 		is_params_ratio=False,
-		col_separator=COL_SEPARATOR
+		col_separator=COL_SEPARATOR,
+		num_workers=1,
+		warm_start=False,
+		checkpoint=None
 		):
 		"""
 		train for all users in user_list
@@ -279,6 +525,22 @@ class LocalRecommendar:
 			is_params_ratio:
 				whether or not training_number_params is list of ratio
 
+			num_workers:
+				num of processes to run users on
+				each process attaches to this recommendar's data once
+				data published to shared memory by this call is released when done
+				1, users run one after another in this process
+				spark models start one spark session per process, better keep 1
+
+			warm_start:
+				whether or not model of each train number starts from previous one, see personalized_train
+
+			checkpoint:
+				EvaluationCheckpoint of finished (model, user, train number), to resume a killed run
+				finished train numbers are read from it, others are trained and recorded to it
+				user_rating_info.data is rewritten from start
+				None, nothing is recorded
+
 		output files:
 		user_rating_info.data:
 			each line contains 
@@ -294,41 +556,107 @@ class LocalRecommendar:
 		best_rk = list()
 		best_tn = list()
 
-		filename = "{}{}".format(output_dir, f"{self.model}_user_rating_info.data")
-		for i in range(len(user_list)):
-			user = user_list[i]
+		train_numbers = list()
+		for user in user_list:
 			train_number = train_number_params
 
 			if is_params_ratio:
 				train_number = [int(x * self.user_ratings[user]) for x in train_number_params]
 
-			pk, rk, apk = self.personalized_train(
-				user_id=user,
-				train_number=train_number
+			train_numbers.append(train_number)
+
+		# only train numbers not finished in checkpoint are trained
+		missing_numbers = list()
+		for (user, train_number) in zip(user_list, train_numbers):
+			if checkpoint is None:
+				missing_numbers.append(train_number)
+			else:
+				missing_numbers.append([
+					number for number in train_number if checkpoint.get(self.model, user, number) is None
+				])
+
+		published = False
+		if num_workers > 1:
+			published = self.shared_dataset is None
+			executor = ProcessPoolExecutor(
+				max_workers=num_workers,
+				initializer=_init_worker,
+				initargs=(self._worker_config(),)
 				)
+			futures = list()
+			for (user, train_number) in zip(user_list, missing_numbers):
+				if len(train_number) == 0:
+					futures.append(None)
+					continue
+
+				future = executor.submit(_personalized_train_job, user, train_number, warm_start)
+				if checkpoint is not None:
+					# record as soon as user is done, not in order of user_list
+					future.add_done_callback(partial(_record_job, checkpoint, self.model, user, train_number))
+				futures.append(future)
+		else:
+			executor = None
 
-			best_index = np.argmax(apk)
-			best_tn.append(train_number[best_index])
-			best_apk.append(apk[best_index])
-			best_pk.append(pk[best_index])
-			best_rk.append(rk[best_index])
-
-			with open(filename, "a") as file:
-				file.write("{}{}{}{}{}{}{}{}{}{}{}\n".format(
-					user, col_separator,
-					self.user_ratings[user], col_separator,
-					best_tn[i], col_separator,
-					best_apk[i], col_separator,
-					best_pk[i], col_separator,
-					best_rk[i]
-					))
+		filename = "{}{}".format(output_dir, f"{self.model}_user_rating_info.data")
+		if checkpoint is not None:
+			open(filename, "w").close()
+
+		try:
+			for i in range(len(user_list)):
+				user = user_list[i]
+				train_number = train_numbers[i]
+
+				# results are collected in order of user_list
+				if len(missing_numbers[i]) == 0:
+					pk, rk, apk = list(), list(), list()
+				elif executor is None:
+					pk, rk, apk = self.personalized_train(
+						user_id=user,
+						train_number=missing_numbers[i],
+						warm_start=warm_start
+						)
+					if checkpoint is not None:
+						checkpoint.record(self.model, user, missing_numbers[i], pk, rk, apk)
+				else:
+					pk, rk, apk = futures[i].result()
+
+				if checkpoint is not None:
+					results = dict(zip(missing_numbers[i], zip(pk, rk, apk)))
+					pk, rk, apk = (list(x) for x in zip(*[
+						results[number] if number in results else checkpoint.get(self.model, user, number)
+						for number in train_number
+					]))
+
+				best_index = np.argmax(apk)
+				best_tn.append(train_number[best_index])
+				best_apk.append(apk[best_index])
+				best_pk.append(pk[best_index])
+				best_rk.append(rk[best_index])
+
+				with open(filename, "a") as file:
+					file.write("{}{}{}{}{}{}{}{}{}{}{}\n".format(
+						user, col_separator,
+						self.user_ratings[user], col_separator,
+						best_tn[i], col_separator,
+						best_apk[i], col_separator,
+						best_pk[i], col_separator,
+						best_rk[i]
+						))
+		finally:
+			if executor is not None:
+				executor.shutdown(cancel_futures=True)
+
+			# dataset shared before this call is left to its publisher
+			if published:
+				self.release_shared_dataset()
 
 		return np.sum(best_apk) / len(user_list)
 
 	def personalized_train(
 		self,
 		user_id,
-		train_number=[1, 3, 5]
+		train_number=[1, 3, 5],
+		warm_start=False
 		):
 		"""
 		do training on single user
@@ -339,53 +667,54 @@ class LocalRecommendar:
 			train_number: 
 				list of number of ratings to consider for this user
 
+			warm_start:
+				true, model of each train number starts from model of previous smaller train number
+					only for models with warm_start, e.g. numpy models
+				false, each model is trained from scratch
+
+		train numbers are done from smallest, their cut-offs are nested prefixes of user's history
+		so reviews of each cut-off are only searched from previous cut-off
+
 		return: 
 			list of precision @ k
 			list of recall @ k
 			list of average precision @ k
 			for each train number
 		"""
-		pk_list = list()
-		rk_list = list()
-		apk_list = list()
+		pk_list = [None] * len(train_number)
+		rk_list = [None] * len(train_number)
+		apk_list = [None] * len(train_number)
+
+		user_reviews = self.user_index.first(user_id, max(train_number, default=0))
+		city_cursor = CityReviewCursor(self.city_index)
+		previous_model = None
 
-		for number in train_number:
+		for index in sorted(range(len(train_number)), key=lambda index: train_number[index]):
+			number = train_number[index]
 			model_name="{}_{}_{}".format(self.model, user_id, number)
 
 			print("\nWorking on {}".format(model_name))
 			print("\tLoad last_timestamp ...")
-			first_number_rating = self.reviews_dataframe[self.reviews_dataframe[COL_USER] == user_id] \
-										.sort_values(COL_TIMESTAMP) \
-										.head(number)
+			first_number_rating = user_reviews.iloc[:number]
 			last_timestamp = int(first_number_rating.iloc[number - 1][COL_TIMESTAMP])
 			print("\tlast_timestamp = {}".format(last_timestamp))
 
 			# only consider rated cities
-			city_list_all = list()
-			for index, row in first_number_rating.iterrows():
-				city_list_all.append(self.rest_city[row[COL_ITEM]])
+			city_list_all = [self.rest_city[item] for item in first_number_rating[COL_ITEM].tolist()]
 
 			# only consider cities for limited number of latest rating
 			if self.infer_loc_by_latest_rating_only:
 				city_list = set()
-				index = len(city_list_all) - 1
-				while index >= 0 and index + self.latest_rating_limiter >= len(city_list_all):
-					city_list.add(city_list_all[index])
-					index -= 1
+				i = len(city_list_all) - 1
+				while i >= 0 and i + self.latest_rating_limiter >= len(city_list_all):
+					city_list.add(city_list_all[i])
+					i -= 1
 			else:
 				city_list = set(city_list_all)
 
 			# only consider restaurants in same cities
-			restaurant_list = list()
-			for (restaurant, city) in self.rest_city.items():
-				if city in city_list:
-					restaurant_list.append(restaurant)
-
 			print("\tLoad subset_reviews ...")
-			subset_reviews = self.reviews_dataframe[
-				(self.reviews_dataframe[COL_ITEM].isin(restaurant_list)) 
-				& (self.reviews_dataframe[COL_TIMESTAMP] <= last_timestamp)
-				]
+			subset_reviews = city_cursor.reviews_until(city_list, last_timestamp)
 			print("\tsubset_reviews: {}".format(subset_reviews.shape))
 
 			print("\tLoad model ...")
@@ -395,6 +724,9 @@ class LocalRecommendar:
 				data_reviews=subset_reviews
 				)
 
+			if warm_start and previous_model is not None and hasattr(model, "warm_start"):
+				model.warm_start(previous_model)
+
 			print("\tModel trained ...")
 			model.train()
 
@@ -404,21 +736,28 @@ class LocalRecommendar:
 				removeSeen=self.removeSeen
 				)
 
-			model.close()
+			# keep model to warm start next one
+			if previous_model is not None:
+				previous_model.close()
+			if warm_start and hasattr(model, "warm_start"):
+				previous_model = model
+			else:
+				model.close()
+				previous_model = None
 
 			print("\tres_dataframe: {}".format(res_dataframe.shape))
 			print("\tCalculate APK & PK & RK ...")
 			pk, rk, apk = evaluate_top_k_for_user(
-				self.reviews_dataframe[
-					(self.reviews_dataframe[COL_USER] == user_id) 
-					& (self.reviews_dataframe[COL_TIMESTAMP] > last_timestamp)
-					],
+				self.user_index.after(user_id, last_timestamp),
 				res_dataframe
 				)
 
-			pk_list.append(pk)
-			rk_list.append(rk)
-			apk_list.append(apk)
+			pk_list[index] = pk
+			rk_list[index] = rk
+			apk_list[index] = apk
+
+		if previous_model is not None:
+			previous_model.close()
 
 		print("\tpk_list: {}".format(pk_list))
 		print("\trk_list: {}".format(rk_list))
@@ -435,50 +774,345 @@ class LocalRecommendar:
 		return:
 			list of top k feature_ids
 		"""
+		city_list = self._infer_cities(user_id)
 
-		# only consider cities for limited number of latest rating
-		if self.infer_loc_by_latest_rating_only:
-			first_number_rating = self.reviews_dataframe[self.reviews_dataframe[COL_USER] == user_id] \
-									.sort_values(COL_TIMESTAMP, ascending=False)
-
-			city_list = set()
-			index = 0
-			while index < first_number_rating.shape[0] and index < self.latest_rating_limiter:
-				city_list.add(self.rest_city[first_number_rating.iloc[index][COL_ITEM]])
-				index += 1
-		else:
-			city_list = set(city_list_all)
+		if self.cache is not None:
+			key = self._cache_key(user_id)
+			version = self._data_version(user_id, city_list)
+			recommendation = self.cache.get(key, version)
+			if recommendation is not None:
+				return list(recommendation)
 
-		# only consider restaurants in same cities
-		restaurant_list = list()
-		for (restaurant, city) in self.rest_city.items():
-			if city in city_list:
-				restaurant_list.append(restaurant)
+		recommendation = self._predict_user(user_id, city_list)
 
-		subset_reviews = self.reviews_dataframe[
-				self.reviews_dataframe[COL_ITEM].isin(restaurant_list)
-				]
+		if self.cache is not None:
+			self.cache.put(key, version, list(recommendation), cities=city_list)
 
-		model = self._get_model(
-				user_id=user_id,
-				model_name="{}_{}".format(self.model, user_id),
-				data_reviews=subset_reviews
-				)
+		return recommendation
 
-		model.train()
+	def predict_many(self, user_ids):
+		"""
+		predict for many users, users with same inferred city set share one model
+
+		user_ids: list of integer ids for users
 
-		res_dataframe = model.predict(
+		return:
+			mapping from user_id to list of top k feature_ids
+
+		if not shared_models, one model is trained for each city set and closed after use
+		models windowed by user, e.g. tbh, are trained for each user as in predict
+		users with cached recommendation are not predicted again
+		repeated user_ids are predicted once
+		"""
+		recommendations = dict()
+		user_to_cities = dict()
+		city_set_to_users = dict()
+		for user_id in dict.fromkeys(user_ids):
+			cities = frozenset(self._infer_cities(user_id))
+
+			if self.cache is not None:
+				recommendation = self.cache.get(
+					self._cache_key(user_id),
+					self._data_version(user_id, cities)
+					)
+				if recommendation is not None:
+					recommendations[user_id] = list(recommendation)
+					continue
+
+			user_to_cities[user_id] = cities
+			if cities not in city_set_to_users:
+				city_set_to_users[cities] = list()
+			city_set_to_users[cities].append(user_id)
+
+		user_to_features = dict()
+		for (cities, users) in city_set_to_users.items():
+			if self._is_user_windowed():
+				for user_id in users:
+					recommendations[user_id] = self._predict_user(user_id, cities)
+				continue
+
+			if self.shared_models:
+				model = self._get_city_model(cities)
+			else:
+				model = self._get_model(
+					user_id=None,
+					model_name="{}_{}".format(self.model, "_".join(sorted(cities))),
+					data_reviews=self.city_index.reviews(cities)
+					)
+				model.train()
+
+			res_dataframe = model.predict_many(
+				user_ids=users,
 				k=self.k,
 				removeSeen=self.removeSeen
 				)
 
-		model.close()
+			if not self.shared_models:
+				model.close()
+
+			for (user, features) in res_dataframe.groupby(COL_USER, sort=False)[COL_ITEM]:
+				user_to_features[user] = features.tolist()
+
+		for (user_id, cities) in user_to_cities.items():
+			if user_id not in recommendations:
+				recommendations[user_id] = map_feature_ids_to_restaurants(
+					feature_list=user_to_features.get(user_id, []),
+					feature_id_to_rest_ids=self.feature_id_to_rest_ids
+					)
+
+			if self.cache is not None:
+				self.cache.put(
+					self._cache_key(user_id),
+					self._data_version(user_id, cities),
+					list(recommendations[user_id]),
+					cities=cities
+					)
+
+		return {user_id : recommendations[user_id] for user_id in user_ids}
+
+	def add_reviews(self, reviews):
+		"""
+		add new reviews, e.g. a user just rated a restaurant
+
+		reviews: list of reviews or pandas dataframe of reviews
+
+		only index spans of users and cities of new reviews are updated
+		cached recommendations of users and cities of new reviews are dropped
+		users of new reviews are folded into their shared model if model supports it
+		"""
+		new_reviews = reviews_to_dataframe(reviews)
+		if new_reviews.shape[0] == 0:
+			return
+
+		self.reviews_dataframe = pd.concat([self.reviews_dataframe, new_reviews], ignore_index=True)
+		self._reviews = None
+
+		# same counting as map_user_to_ratings, built from all reviews if not built yet
+		if self._user_ratings is not None:
+			for user in new_reviews[COL_USER].tolist():
+				if user not in self._user_ratings:
+					self._user_ratings[user] = 0
+				else:
+					self._user_ratings[user] = self._user_ratings[user] + 1
+
+		# only spans of affected users and cities change
+		positions = np.arange(self.reviews_dataframe.shape[0] - new_reviews.shape[0], self.reviews_dataframe.shape[0])
+		self.user_index.add_rows(self.reviews_dataframe, positions)
+		self.city_index.add_rows(self.reviews_dataframe, positions)
+		self.city_review_counts = self.city_index.counts()
+
+		# published dataset is stale, published again when asked
+		self.release_shared_dataset()
+
+		users = pd.unique(new_reviews[COL_USER].to_numpy()).tolist()
+		cities = set(
+			self.rest_city[item] for item in new_reviews[COL_ITEM].tolist() if item in self.rest_city
+			)
+
+		if self.cache is not None:
+			for user in users:
+				self.cache.invalidate_user(user)
+			for city in cities:
+				self.cache.invalidate_city(city)
+
+		if self._uses_shared_models():
+			for user in users:
+				self._fold_in_city_model(user)
+
+	def cache_stats(self):
+		"""
+		return mapping of hits, misses and size of self.cache, None if not cached
+		"""
+		if self.cache is None:
+			return None
+		return self.cache.stats()
+
+	def build_city_models(self, user_list=None, num_workers=1):
+		"""
+		train shared models up front, one for each city set inferred from users
+
+			user_list:
+				users whose city sets to build models for
+				default to all users in reviews
+
+			num_workers:
+				number of threads to train models
+				largest city sets are scheduled first
+
+		models already built are kept
+		return number of models built, 0 if model is windowed by user
+		"""
+		if not self._uses_shared_models():
+			return 0
+
+		if user_list is None:
+			user_list = self.user_index.users.tolist()
+
+		city_sets = set()
+		for user in user_list:
+			city_sets.add(frozenset(self._infer_cities(user)))
+
+		with self.city_models_lock:
+			city_sets = [cities for cities in city_sets if cities not in self.city_models]
+
+		city_sets.sort(key=lambda cities: len(self.city_index.positions(cities)), reverse=True)
+
+		with ThreadPoolExecutor(max_workers=num_workers) as executor:
+			list(executor.map(self._get_city_model, city_sets))
+
+		return len(city_sets)
+
+	def close(self):
+		"""
+		close all shared models, release dataset published to shared memory
+		"""
+		with self.city_models_lock:
+			city_models = self.city_models
+			self.city_models = dict()
+
+		for model in city_models.values():
+			model.close()
+
+		self.release_shared_dataset()
+
+	def _predict_user(self, user_id, city_list):
+		"""
+		return list of top k feature_ids of user_id, scored on reviews of restaurants in city_list
+		not cached
+		"""
+		if self._uses_shared_models():
+			res_dataframe = self._get_city_model(city_list).predict(
+				k=self.k,
+				removeSeen=self.removeSeen,
+				user_id=user_id
+				)
+		else:
+			# only consider restaurants in same cities
+			subset_reviews = self.city_index.reviews(city_list)
+
+			model = self._get_model(
+					user_id=user_id,
+					model_name="{}_{}".format(self.model, user_id),
+					data_reviews=subset_reviews
+					)
+
+			model.train()
+
+			res_dataframe = model.predict(
+					k=self.k,
+					removeSeen=self.removeSeen
+					)
+
+			model.close()
 
-		return map_feature_ids_to_restaurants(
+		recommendation = map_feature_ids_to_restaurants(
 			feature_list=res_dataframe[COL_ITEM].tolist(),
-			rest_id_to_int=self.rest_id_to_int
+			feature_id_to_rest_ids=self.feature_id_to_rest_ids
 			)
 
+		return recommendation
+
+	def _is_user_windowed(self):
+		"""
+		return whether or not model windows data by user's latest rating, such model can't be shared
+		"""
+		return getattr(MAPPING_MODEL[self.model], "user_windowed", False)
+
+	def _uses_shared_models(self):
+		"""
+		return whether or not predict uses models shared by city set
+		"""
+		return self.shared_models and not self._is_user_windowed()
+
+	def _infer_cities(self, user_id):
+		"""
+		return set of cities user is in, by latest ratings or all ratings
+		"""
+		positions = self.user_index.positions(user_id)
+
+		# only consider cities for limited number of latest rating
+		if self.infer_loc_by_latest_rating_only:
+			positions = positions[max(len(positions) - self.latest_rating_limiter, 0):]
+
+		items = self.reviews_dataframe[COL_ITEM].to_numpy()[positions]
+		return set(self.rest_city[item] for item in items.tolist())
+
+	def _worker_config(self):
+		"""
+		return keyword arguments to load same recommendar in worker process
+			dataset is published to shared memory, workers attach to it without copy
+		"""
+		return {
+			"shared_dataset" : self.share_dataset(),
+			"model" : self.model,
+			"k" : self.k,
+			"removeSeen" : self.removeSeen,
+			"infer_loc_by_latest_rating_only" : self.infer_loc_by_latest_rating_only,
+			"latest_rating_limiter" : self.latest_rating_limiter
+		}
+
+	def _cache_key(self, user_id):
+		"""
+		return key of user_id in self.cache
+		"""
+		return (user_id, self.model, self.k, self.removeSeen, self.latest_rating_limiter)
+
+	def _data_version(self, user_id, cities):
+		"""
+		return version of data recommendation of user_id depends on
+			latest review timestamp of user, num of reviews in each of user's cities
+		"""
+		start, end = self.user_index.span(user_id)
+		latest_timestamp = int(self.user_index.timestamps[end - 1]) if end > start else None
+		return (
+			latest_timestamp,
+			tuple(sorted((city, self.city_review_counts.get(city, 0)) for city in cities))
+			)
+
+	def _fold_in_city_model(self, user_id):
+		"""
+		update user_id in shared model of user's city set, if built and model supports fold in
+		"""
+		cities = frozenset(self._infer_cities(user_id))
+		with self.city_models_lock:
+			model = self.city_models.get(cities)
+
+		if model is None or not hasattr(model, "fold_in_user"):
+			return
+
+		user_reviews = self.reviews_dataframe.iloc[self.user_index.positions(user_id)]
+		items_in_cities = [self.rest_city.get(item) in cities for item in user_reviews[COL_ITEM].tolist()]
+		model.fold_in_user(user_id, user_reviews[items_in_cities])
+
+	def _get_city_model(self, cities):
+		"""
+		return shared model trained on reviews of restaurants in cities
+		model is trained on first request and kept in self.city_models
+		"""
+		key = frozenset(cities)
+		with self.city_models_lock:
+			if key in self.city_models:
+				return self.city_models[key]
+			key_lock = self.city_model_locks.setdefault(key, threading.Lock())
+
+		# same city set is trained once, different city sets in parallel
+		with key_lock:
+			with self.city_models_lock:
+				if key in self.city_models:
+					return self.city_models[key]
+
+			model = self._get_model(
+				user_id=None,
+				model_name="{}_{}".format(self.model, "_".join(sorted(key))),
+				data_reviews=self.city_index.reviews(key)
+				)
+			model.train()
+
+			with self.city_models_lock:
+				self.city_models[key] = model
+
+		return model
+
 	def _get_model(self, user_id, model_name, data_reviews):
 		"""
 		factory method to get user personalized model
@@ -0,0 +1,176 @@
+import sys
+import time
+import threading
+from collections import OrderedDict
+
+#-------------------------------
+# Constants
+#-------------------------------
+DEFAULT_CACHE_ENTRIES = 100000
+DEFAULT_CACHE_BYTES = 256 * 1024 * 1024
+
+def estimate_bytes(value):
+	"""
+	helper function
+	return approximate memory of a cached value, list of restaurant ids or mapping
+	"""
+	if isinstance(value, dict):
+		return sys.getsizeof(value) + sum(
+			estimate_bytes(key) + estimate_bytes(val) for (key, val) in value.items()
+			)
+	if isinstance(value, (list, tuple, set, frozenset)):
+		return sys.getsizeof(value) + sum(estimate_bytes(val) for val in value)
+	return sys.getsizeof(value)
+
+class RecommendationCache:
+	"""
+	in-process LRU cache of recommendations with time to live and memory cap
+
+	each entry is kept with the data version it was computed on,
+	entry with a different version is a miss and dropped
+
+	state:
+		self.max_entries : max num of entries
+		self.max_bytes : max approximate memory of entries
+		self.ttl : seconds an entry lives, None to live until evicted
+		self.entries : key maps to (value, version, cities, expire_time, nbytes), least recent first
+		self.nbytes : approximate memory of entries
+		self.hits : num of get returning a cached value
+		self.misses : num of get not returning a cached value
+		self.evictions : num of entries dropped by size, memory or ttl
+		self.invalidations : num of entries dropped by invalidate_* or version change
+	"""
+	def __init__(
+		self,
+		max_entries=DEFAULT_CACHE_ENTRIES,
+		max_bytes=DEFAULT_CACHE_BYTES,
+		ttl=None
+		):
+		"""
+		max_entries: max num of entries
+		max_bytes: max approximate memory of entries
+		ttl: seconds an entry lives, None to live until evicted
+		"""
+		self.max_entries = max_entries
+		self.max_bytes = max_bytes
+		self.ttl = ttl
+
+		self.entries = OrderedDict()
+		self.nbytes = 0
+
+		self.hits = 0
+		self.misses = 0
+		self.evictions = 0
+		self.invalidations = 0
+
+		self.lock = threading.Lock()
+
+	def __len__(self):
+		return len(self.entries)
+
+	def get(self, key, version):
+		"""
+		key: e.g. (user, model name, k, removeSeen, latest_rating_limiter)
+		version: version of data the value should be computed on
+
+		return cached value, None if missed
+		"""
+		with self.lock:
+			if key not in self.entries:
+				self.misses += 1
+				return None
+
+			(value, entry_version, cities, expire_time, nbytes) = self.entries[key]
+			if expire_time is not None and expire_time <= time.monotonic():
+				self._drop(key)
+				self.evictions += 1
+				self.misses += 1
+				return None
+
+			if entry_version != version:
+				self._drop(key)
+				self.invalidations += 1
+				self.misses += 1
+				return None
+
+			self.entries.move_to_end(key)
+			self.hits += 1
+			return value
+
+	def put(self, key, version, value, cities=()):
+		"""
+		key: e.g. (user, model name, k, removeSeen, latest_rating_limiter)
+		version: version of data value is computed on
+		value: value to cache
+		cities: cities value depends on, see invalidate_city
+		"""
+		nbytes = estimate_bytes(value)
+		expire_time = None if self.ttl is None else time.monotonic() + self.ttl
+
+		with self.lock:
+			if key in self.entries:
+				self._drop(key)
+
+			# value larger than whole cache is not kept
+			if nbytes > self.max_bytes:
+				return
+
+			self.entries[key] = (value, version, frozenset(cities), expire_time, nbytes)
+			self.nbytes += nbytes
+
+			while len(self.entries) > self.max_entries or self.nbytes > self.max_bytes:
+				self._drop(next(iter(self.entries)))
+				self.evictions += 1
+
+	def invalidate_user(self, user_id):
+		"""
+		drop all entries of user_id, key of entry starts with user
+
+		return num of entries dropped
+		"""
+		with self.lock:
+			keys = [key for key in self.entries if key[0] == user_id]
+			return self._invalidate(keys)
+
+	def invalidate_city(self, city):
+		"""
+		drop all entries depending on city
+
+		return num of entries dropped
+		"""
+		with self.lock:
+			keys = [key for (key, entry) in self.entries.items() if city in entry[2]]
+			return self._invalidate(keys)
+
+	def clear(self):
+		"""
+		drop all entries, counters are kept
+		"""
+		with self.lock:
+			self._invalidate(list(self.entries))
+
+	def stats(self):
+		"""
+		return mapping of counters, size and hit rate
+		"""
+		with self.lock:
+			lookups = self.hits + self.misses
+			return {
+				"entries" : len(self.entries),
+				"bytes" : self.nbytes,
+				"hits" : self.hits,
+				"misses" : self.misses,
+				"hit_rate" : self.hits / lookups if lookups > 0 else 0,
+				"evictions" : self.evictions,
+				"invalidations" : self.invalidations
+			}
+
+	def _invalidate(self, keys):
+		for key in keys:
+			self._drop(key)
+		self.invalidations += len(keys)
+		return len(keys)
+
+	def _drop(self, key):
+		entry = self.entries.pop(key)
+		self.nbytes -= entry[4]
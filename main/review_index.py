@@ -0,0 +1,406 @@
+import numpy as np
+
+from main.constants import *
+
+def group_by_key_and_time(keys, timestamps):
+	"""
+	helper function
+	group rows by key, rows of each key sorted by timestamp
+	ties in timestamp keep original row order
+
+	keys: numpy array of key of each row
+	timestamps: numpy array of timestamp of each row
+
+	return:
+		order : row positions sorted by key then timestamp
+		unique_keys : sorted unique keys
+		offsets : start of each key in order, with total num of rows at the end
+	"""
+	# lexsort is stable, last key is primary key
+	order = np.lexsort((timestamps, keys))
+
+	sorted_keys = keys[order]
+	is_start = np.ones(len(sorted_keys), dtype=bool)
+	is_start[1:] = sorted_keys[1:] != sorted_keys[:-1]
+	starts = np.flatnonzero(is_start)
+
+	return order, sorted_keys[starts], np.append(starts, len(sorted_keys))
+
+def insert_into_groups(order, timestamps, offsets, codes, new_timestamps, new_positions):
+	"""
+	helper function
+	insert new rows into groups in CSR layout, without sorting indexed rows again
+	new rows must be after all indexed rows, same result as group_by_key_and_time over all rows
+
+	order: row positions sorted by group then timestamp
+	timestamps: timestamps of rows in order
+	offsets: start of each group in order, with total num of rows at the end
+	codes: numpy array of group of each new row, position in offsets
+	new_timestamps: numpy array of timestamp of each new row
+	new_positions: numpy array of row position of each new row
+
+	return order, timestamps, offsets with new rows
+	"""
+	sort = np.lexsort((new_positions, new_timestamps, codes))
+	codes = codes[sort]
+	new_timestamps = new_timestamps[sort]
+	new_positions = new_positions[sort]
+
+	# new rows go after indexed rows of same group and timestamp, as their positions are larger
+	points = np.empty(len(codes), dtype=np.int64)
+	for code in np.unique(codes).tolist():
+		rows = np.flatnonzero(codes == code)
+		start, end = int(offsets[code]), int(offsets[code + 1])
+		points[rows] = start + np.searchsorted(timestamps[start:end], new_timestamps[rows], side="right")
+
+	order = np.insert(order, points, new_positions)
+	timestamps = np.insert(timestamps, points, new_timestamps)
+
+	counts = np.diff(offsets) + np.bincount(codes, minlength=len(offsets) - 1)
+	offsets = np.append(0, np.cumsum(counts))
+
+	return order, timestamps, offsets
+
+class UserReviewIndex:
+	"""
+	reviews grouped by user and sorted by timestamp, in CSR layout
+
+	reviews of users[i] are rows order[offsets[i]:offsets[i + 1]] of reviews_dataframe
+	ties in timestamp keep original row order
+
+	state:
+		self.reviews_dataframe : pandas dataframe of reviews being indexed
+		self.order : row positions of reviews_dataframe sorted by user then timestamp
+		self.users : sorted unique int_user_id
+		self.offsets : start of each user in self.order, with total num of reviews at the end
+		self.timestamps : timestamps of reviews in self.order
+	"""
+	def __init__(self, reviews_dataframe):
+		"""
+		reviews_dataframe: pandas dataframe of reviews
+		"""
+		self.reviews_dataframe = reviews_dataframe
+
+		timestamps = reviews_dataframe[COL_TIMESTAMP].to_numpy()
+		self.order, self.users, self.offsets = group_by_key_and_time(
+			reviews_dataframe[COL_USER].to_numpy(),
+			timestamps
+			)
+		self.timestamps = timestamps[self.order]
+
+	@classmethod
+	def from_arrays(cls, reviews_dataframe, arrays):
+		"""
+		reviews_dataframe: pandas dataframe of reviews being indexed
+		arrays: mapping from to_arrays, e.g. attached from shared memory
+
+		return index over arrays, not copied
+		"""
+		index = cls.__new__(cls)
+		index.reviews_dataframe = reviews_dataframe
+		index.order = arrays["order"]
+		index.users = arrays["users"]
+		index.offsets = arrays["offsets"]
+		index.timestamps = arrays["timestamps"]
+		return index
+
+	def to_arrays(self):
+		"""
+		return mapping from name to numpy array of this index, without reviews_dataframe
+		"""
+		return {
+			"order" : self.order,
+			"users" : self.users,
+			"offsets" : self.offsets,
+			"timestamps" : self.timestamps
+		}
+
+	def add_rows(self, reviews_dataframe, positions):
+		"""
+		reviews_dataframe: reviews being indexed with new rows appended
+		positions: numpy array of row positions of new rows, after all indexed rows
+
+		only spans of users of new rows change, indexed rows are not sorted again
+		"""
+		users = reviews_dataframe[COL_USER].to_numpy()[positions]
+		timestamps = reviews_dataframe[COL_TIMESTAMP].to_numpy()[positions]
+
+		# new users get empty span first, self.users is already sorted
+		new_users = np.unique(users)
+		index = np.minimum(np.searchsorted(self.users, new_users), max(len(self.users) - 1, 0))
+		if len(self.users) > 0:
+			new_users = new_users[self.users[index] != new_users]
+		if len(new_users) > 0:
+			index = np.searchsorted(self.users, new_users)
+			self.users = np.insert(self.users, index, new_users)
+			self.offsets = np.insert(self.offsets, index, self.offsets[index])
+
+		self.order, self.timestamps, self.offsets = insert_into_groups(
+			self.order,
+			self.timestamps,
+			self.offsets,
+			np.searchsorted(self.users, users),
+			timestamps,
+			np.asarray(positions, dtype=self.order.dtype)
+			)
+		self.reviews_dataframe = reviews_dataframe
+
+	def __contains__(self, user_id):
+		index = np.searchsorted(self.users, user_id)
+		return index < len(self.users) and self.users[index] == user_id
+
+	def span(self, user_id):
+		"""
+		return (start, end) of user_id in self.order, empty span if user has no reviews
+		"""
+		index = np.searchsorted(self.users, user_id)
+		if index == len(self.users) or self.users[index] != user_id:
+			return 0, 0
+		return int(self.offsets[index]), int(self.offsets[index + 1])
+
+	def count(self, user_id):
+		"""
+		return num of reviews of user_id
+		"""
+		start, end = self.span(user_id)
+		return end - start
+
+	def positions(self, user_id):
+		"""
+		return row positions of all reviews of user_id, oldest first
+		"""
+		start, end = self.span(user_id)
+		return self.order[start:end]
+
+	def first(self, user_id, number):
+		"""
+		return pandas dataframe of first number reviews of user_id, oldest first
+		"""
+		start, end = self.span(user_id)
+		return self.reviews_dataframe.iloc[self.order[start:min(start + number, end)]]
+
+	def latest(self, user_id, number):
+		"""
+		return pandas dataframe of latest number reviews of user_id, latest first
+		"""
+		start, end = self.span(user_id)
+		return self.reviews_dataframe.iloc[self.order[max(end - number, start):end][::-1]]
+
+	def after(self, user_id, timestamp):
+		"""
+		return pandas dataframe of reviews of user_id later than timestamp, oldest first
+		"""
+		start, end = self.span(user_id)
+		cut = start + np.searchsorted(self.timestamps[start:end], timestamp, side="right")
+		return self.reviews_dataframe.iloc[self.order[cut:end]]
+
+class CityReviewIndex:
+	"""
+	reviews partitioned by city of restaurant, reviews sorted by timestamp
+
+	reviews on restaurants of cities[i] are rows order[offsets[i]:offsets[i + 1]] of reviews_dataframe
+	reviews on restaurants without city are left out
+
+	state:
+		self.reviews_dataframe : pandas dataframe of reviews being indexed
+		self.city_to_code : city maps to position in self.offsets, in order of rest_city
+		self.feature_id_to_code : feature_id maps to city code of its restaurant
+		self.order : row positions of reviews_dataframe sorted by city then timestamp
+		self.offsets : start of each city in self.order, with total num of reviews at the end
+		self.timestamps : timestamps of reviews in self.order
+	"""
+	def __init__(self, reviews_dataframe, rest_city):
+		"""
+		reviews_dataframe: pandas dataframe of reviews
+		rest_city: mapping from feature_id to city
+		"""
+		self.reviews_dataframe = reviews_dataframe
+		self._map_cities(rest_city)
+
+		items = reviews_dataframe[COL_ITEM].to_numpy()
+		timestamps = reviews_dataframe[COL_TIMESTAMP].to_numpy()
+
+		# city code of each feature_id, -1 if feature_id has no city
+		max_feature_id = max(max(rest_city, default=0), int(items.max()) if len(items) > 0 else 0)
+		feature_id_to_code = np.full(max_feature_id + 1, -1, dtype=np.int64)
+		for (feature_id, code) in self.feature_id_to_code.items():
+			feature_id_to_code[feature_id] = code
+
+		review_codes = feature_id_to_code[items]
+		has_city = np.flatnonzero(review_codes >= 0)
+
+		order, codes, starts = group_by_key_and_time(review_codes[has_city], timestamps[has_city])
+		self.order = has_city[order]
+		self.timestamps = timestamps[self.order]
+
+		# cities without reviews get empty span
+		self.offsets = np.zeros(len(self.city_to_code) + 1, dtype=np.int64)
+		self.offsets[codes + 1] = np.diff(starts)
+		self.offsets = np.cumsum(self.offsets)
+
+	@classmethod
+	def from_arrays(cls, reviews_dataframe, rest_city, arrays):
+		"""
+		reviews_dataframe: pandas dataframe of reviews being indexed
+		rest_city: mapping from feature_id to city, same as index is built on
+		arrays: mapping from to_arrays, e.g. attached from shared memory
+
+		return index over arrays, not copied
+		"""
+		index = cls.__new__(cls)
+		index.reviews_dataframe = reviews_dataframe
+		index._map_cities(rest_city)
+		index.order = arrays["order"]
+		index.offsets = arrays["offsets"]
+		index.timestamps = arrays["timestamps"]
+		return index
+
+	def to_arrays(self):
+		"""
+		return mapping from name to numpy array of this index, without reviews_dataframe and cities
+		"""
+		return {
+			"order" : self.order,
+			"offsets" : self.offsets,
+			"timestamps" : self.timestamps
+		}
+
+	def _map_cities(self, rest_city):
+		self.city_to_code = dict()
+		self.feature_id_to_code = dict()
+		for (feature_id, city) in rest_city.items():
+			if city not in self.city_to_code:
+				self.city_to_code[city] = len(self.city_to_code)
+			self.feature_id_to_code[feature_id] = self.city_to_code[city]
+
+	def add_rows(self, reviews_dataframe, positions):
+		"""
+		reviews_dataframe: reviews being indexed with new rows appended
+		positions: numpy array of row positions of new rows, after all indexed rows
+
+		only spans of cities of new rows change, indexed rows are not sorted again
+		"""
+		items = reviews_dataframe[COL_ITEM].to_numpy()[positions]
+		codes = np.fromiter(
+			(self.feature_id_to_code.get(item, -1) for item in items.tolist()),
+			dtype=np.int64,
+			count=len(items)
+			)
+		has_city = np.flatnonzero(codes >= 0)
+
+		self.order, self.timestamps, self.offsets = insert_into_groups(
+			self.order,
+			self.timestamps,
+			self.offsets,
+			codes[has_city],
+			reviews_dataframe[COL_TIMESTAMP].to_numpy()[positions][has_city],
+			np.asarray(positions, dtype=self.order.dtype)[has_city]
+			)
+		self.reviews_dataframe = reviews_dataframe
+
+	def counts(self):
+		"""
+		return mapping from city to num of reviews on restaurants in city
+		"""
+		counts = np.diff(self.offsets).tolist()
+		return {city : counts[code] for (city, code) in self.city_to_code.items()}
+
+	def positions(self, cities, last_timestamp=None):
+		"""
+		cities: cities of restaurants
+		last_timestamp: only reviews not later than last_timestamp if given
+
+		return row positions of reviews on restaurants in cities, in original row order
+		"""
+		positions = list()
+		for city in set(cities):
+			if city not in self.city_to_code:
+				continue
+
+			code = self.city_to_code[city]
+			start, end = int(self.offsets[code]), int(self.offsets[code + 1])
+			if last_timestamp is not None:
+				end = start + np.searchsorted(self.timestamps[start:end], last_timestamp, side="right")
+			positions.append(self.order[start:end])
+
+		if len(positions) == 0:
+			return np.zeros(0, dtype=np.int64)
+		return np.sort(np.concatenate(positions))
+
+	def reviews(self, cities, last_timestamp=None):
+		"""
+		cities: cities of restaurants
+		last_timestamp: only reviews not later than last_timestamp if given
+
+		return pandas dataframe of reviews on restaurants in cities, in original row order
+		"""
+		return self.reviews_dataframe.iloc[self.positions(cities, last_timestamp)]
+
+class CityReviewCursor:
+	"""
+	reviews on restaurants in cities up to a last_timestamp that only grows, e.g. nested prefixes of a user
+
+	each call only searches and merges reviews between previous and new last_timestamp
+	same reviews as city_index.reviews(cities, last_timestamp)
+
+	state:
+		self.city_index : CityReviewIndex being walked
+		self.last_timestamp : last_timestamp of previous call
+		self.ends : city maps to end in city_index.order of reviews not later than self.last_timestamp
+		self.cities : cities of previous call
+		self.positions : row positions of previous call, in original row order
+	"""
+	def __init__(self, city_index):
+		"""
+		city_index: CityReviewIndex to walk
+		"""
+		self.city_index = city_index
+		self.last_timestamp = None
+		self.ends = dict()
+		self.cities = set()
+		self.positions = np.zeros(0, dtype=np.int64)
+
+	def positions_until(self, cities, last_timestamp):
+		"""
+		cities: cities of restaurants
+		last_timestamp: only reviews not later than last_timestamp, not earlier than previous call
+
+		return row positions of reviews on restaurants in cities, in original row order
+		"""
+		if self.last_timestamp is not None and last_timestamp < self.last_timestamp:
+			raise ValueError(f"last_timestamp {last_timestamp} is earlier than {self.last_timestamp}")
+
+		index = self.city_index
+		cities = set(city for city in cities if city in index.city_to_code)
+
+		# previous positions are kept if no city is dropped
+		keep = self.cities <= cities
+
+		parts = [self.positions] if keep else list()
+		for city in cities:
+			code = index.city_to_code[city]
+			start, city_end = int(index.offsets[code]), int(index.offsets[code + 1])
+
+			end = self.ends.get(city, start)
+			end += np.searchsorted(index.timestamps[end:city_end], last_timestamp, side="right")
+
+			if keep and city in self.cities:
+				parts.append(index.order[self.ends[city]:end])
+			else:
+				parts.append(index.order[start:end])
+			self.ends[city] = int(end)
+
+		# previous positions are one sorted run, stable sort merges new positions into it
+		self.positions = np.sort(np.concatenate(parts), kind="stable") if len(parts) > 0 else np.zeros(0, dtype=np.int64)
+		self.cities = cities
+		self.last_timestamp = last_timestamp
+		return self.positions
+
+	def reviews_until(self, cities, last_timestamp):
+		"""
+		cities: cities of restaurants
+		last_timestamp: only reviews not later than last_timestamp, not earlier than previous call
+
+		return pandas dataframe of reviews on restaurants in cities, in original row order
+		"""
+		return self.city_index.reviews_dataframe.iloc[self.positions_until(cities, last_timestamp)]
@@ -0,0 +1,122 @@
+import sys
+import atexit
+import threading
+import numpy as np
+from multiprocessing import shared_memory, resource_tracker
+
+#-------------------------------
+# Process-wide Segments
+#-------------------------------
+_shared_lock = threading.Lock()
+
+# segment name maps to SharedMemory created by this process, unlinked at exit
+_published = dict()
+
+# segment name maps to SharedMemory attached by this process, kept open while arrays are in use
+_attached = dict()
+
+_release_registered = False
+
+def _attach_segment(segment_name):
+	"""
+	helper function
+	return SharedMemory of segment_name, not tracked by this process
+
+	before python 3.13, attaching registers segment to resource tracker of this process
+	which unlinks it when that tracker exits, even though publisher still uses it
+	"""
+	if sys.version_info >= (3, 13):
+		return shared_memory.SharedMemory(name=segment_name, track=False)
+
+	register = resource_tracker.register
+	resource_tracker.register = lambda name, rtype: None
+	try:
+		return shared_memory.SharedMemory(name=segment_name)
+	finally:
+		resource_tracker.register = register
+
+def publish_arrays(arrays):
+	"""
+	copy arrays into shared memory segments owned by this process
+
+	arrays: mapping from name to numpy array, object arrays are not supported
+
+	return:
+		handles : mapping from name to (segment name, dtype, shape), small and picklable
+			see attach_arrays
+
+	segments are unlinked by release_arrays or when this process exits
+	"""
+	global _release_registered
+
+	handles = dict()
+	with _shared_lock:
+		if not _release_registered:
+			atexit.register(release_all)
+			_release_registered = True
+
+		for (name, array) in arrays.items():
+			array = np.ascontiguousarray(array)
+			if array.dtype.hasobject:
+				raise ValueError(f"array {name} has dtype {array.dtype}: object arrays can't be shared")
+
+			segment = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+			np.ndarray(array.shape, dtype=array.dtype, buffer=segment.buf)[...] = array
+
+			_published[segment.name] = segment
+			handles[name] = (segment.name, array.dtype.str, array.shape)
+
+	return handles
+
+def attach_arrays(handles):
+	"""
+	handles: mapping from name to (segment name, dtype, shape), from publish_arrays
+
+	return mapping from name to read-only numpy array backed by shared memory, not copied
+	"""
+	arrays = dict()
+	with _shared_lock:
+		for (name, (segment_name, dtype, shape)) in handles.items():
+			segment = _published.get(segment_name)
+			if segment is None:
+				segment = _attached.get(segment_name)
+			if segment is None:
+				segment = _attach_segment(segment_name)
+				_attached[segment_name] = segment
+
+			array = np.ndarray(tuple(shape), dtype=np.dtype(dtype), buffer=segment.buf)
+			array.flags.writeable = False
+			arrays[name] = array
+
+	return arrays
+
+def release_arrays(handles):
+	"""
+	unlink segments of handles published by this process
+
+	arrays attached to them stay valid until dropped, new attaches fail
+	"""
+	with _shared_lock:
+		for (segment_name, _, _) in handles.values():
+			if segment_name in _published:
+				_release(_published.pop(segment_name))
+
+def release_all():
+	"""
+	unlink all segments published by this process, registered at exit
+	"""
+	with _shared_lock:
+		while len(_published) > 0:
+			_release(_published.popitem()[1])
+
+def _release(segment):
+	try:
+		segment.unlink()
+	except FileNotFoundError:
+		pass
+
+	# segment can't be closed while numpy arrays still use its buffer, it is unmapped at exit
+	try:
+		segment.close()
+	except BufferError:
+		pass